@@ -0,0 +1,142 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Relative CPU cost of each heavy stage for a full-size (REFERENCE_PIXELS) page,
+# per thread it runs on: 'pdf' is rasterizing a page, 'export' writing a PDF
+STAGE_COSTS = {
+    'enhance': 1.0,
+    'ocr': 1.0,
+    'pdf': 0.5,
+    'export': 1.0,
+    'video': 2.0,
+}
+
+# A 2000 x 2000 page, the default ImageSettings.max_dimension
+REFERENCE_PIXELS = 2000 * 2000
+
+# Small pages still pay fixed per-page overheads
+MIN_COST = 0.25
+
+class Cancelled(Exception):
+    """Raised by admit() when the waiting job's cancel event is set"""
+
+def estimate_cost(stage, size=None, parallelism=1):
+    """CPU cores a stage is expected to keep busy for an image of size (width, height)
+
+    parallelism is how many threads or processes the stage fans out to, e.g.
+    OCR recognizing the regions of a page concurrently.
+    """
+    cost = STAGE_COSTS[stage] * parallelism
+    if size is not None:
+        # Pages are downscaled to max_dimension before the heavy work, so cost stops growing there
+        cost *= min(size[0] * size[1], REFERENCE_PIXELS) / REFERENCE_PIXELS
+    return max(MIN_COST, cost)
+
+class _Ticket:
+    def __init__(self, session, cost):
+        self.session = session
+        self.cost = cost
+        self.admitted = False
+
+class AdmissionController:
+    """Process-wide budget for heavy work, shared fairly between sessions
+
+    Work is admitted while the summed cost of running jobs stays within the
+    budget (in CPU cores). Waiting jobs queue per session and sessions take
+    turns, so one user's large batch cannot delay everyone else's next page
+    by more than one job per busy session.
+    """
+
+    def __init__(self, budget=None, poll_interval=0.5):
+        self.budget = float(budget or os.cpu_count() or 1)
+        self.poll_interval = poll_interval
+        self.in_use = 0.0
+        self.running = {}
+        # Sessions with waiting work, in the order they get their next turn
+        self._queues = OrderedDict()
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def admit(self, session, cost, on_wait=None, cancelled=None):
+        """Block until the job may run; on_wait(position, waiting) is called while queued
+
+        Raises Cancelled if the cancelled event is set before the job is admitted.
+        """
+        ticket = _Ticket(session, min(cost, self.budget))
+        with self._condition:
+            self._queues.setdefault(session, deque()).append(ticket)
+            self._dispatch()
+        try:
+            while True:
+                with self._condition:
+                    if ticket.admitted:
+                        break
+                    position = self._position(session)
+                if cancelled is not None and cancelled.is_set():
+                    raise Cancelled("Processing was cancelled")
+                # Outside the lock, since the callback may update the UI
+                if on_wait is not None:
+                    on_wait(*position)
+                with self._condition:
+                    if not ticket.admitted:
+                        self._condition.wait(self.poll_interval)
+            yield
+        finally:
+            with self._condition:
+                if ticket.admitted:
+                    self.in_use -= ticket.cost
+                    self.running[session] -= 1
+                    if not self.running[session]:
+                        del self.running[session]
+                else:
+                    # Abandoned while queued (e.g. the session reran its script)
+                    self._remove(ticket)
+                self._dispatch()
+
+    def position(self, session):
+        """(position, waiting): the session's next queued job is position-th in line, 0 if none is queued"""
+        with self._condition:
+            return self._position(session)
+
+    def stats(self):
+        with self._condition:
+            return {'budget': self.budget, 'in_use': round(self.in_use, 2),
+                    'running_sessions': len(self.running),
+                    'waiting': sum(len(tickets) for tickets in self._queues.values())}
+
+    def _position(self, session):
+        waiting = sum(len(tickets) for tickets in self._queues.values())
+        sessions = list(self._queues)
+        if session not in self._queues:
+            return 0, waiting
+        # Every session ahead in the rotation runs one job before this one
+        return sessions.index(session) + 1, waiting
+
+    def _remove(self, ticket):
+        tickets = self._queues.get(ticket.session)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._queues[ticket.session]
+
+    def _dispatch(self):
+        """Admit queued jobs in turn order while they fit in the budget (call with the lock held)"""
+        admitted = False
+        while self._queues:
+            session, tickets = next(iter(self._queues.items()))
+            ticket = tickets[0]
+            # Strict turn order: a large job waits for room instead of being overtaken forever
+            if self.in_use + ticket.cost > self.budget + 1e-9:
+                break
+            tickets.popleft()
+            del self._queues[session]
+            if tickets:
+                self._queues[session] = tickets
+            ticket.admitted = True
+            self.in_use += ticket.cost
+            self.running[session] = self.running.get(session, 0) + 1
+            admitted = True
+        if admitted:
+            self._condition.notify_all()
@@ -0,0 +1,584 @@
+"""Headless HTTP API for the scan, enhance and OCR pipeline.
+
+Run with: python api_server.py [--host H] [--port P] [--workers N]
+Uploads are multipart/form-data with one or more 'file' parts. Settings from
+ImageSettings (contrast, max_dimension, bw_mode, ...) can be passed as query
+parameters. CPU work runs in a process pool so the event loop only moves bytes;
+uploads and export pages travel to and from the pool through shared memory
+blocks, so only small handles are pickled.
+
+    POST /v1/enhance   enhanced page image (?format=PNG|JPEG|WEBP|AVIF|PDF&quality=95&page=1)
+    POST /v1/detect    document corners as JSON, or the cropped page with ?crop=true
+    POST /v1/ocr       text and decoded QR/barcode symbols as JSON (?enhance=false to OCR the upload
+                       as is, ?skip_ocr_with_symbols=true to return only the symbols when any decode)
+    POST /v1/export    OCR export (?format=txt|json|xlsx|pdf|searchable-pdf)
+    POST /v1/batch     every page of every file, streamed as NDJSON lines as they finish
+    GET  /health       liveness
+    GET  /metrics      request counts, latencies and pages/second
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from shared_buffers import BufferPool, ImageHandle, block_size_for, read_image, write_image
+
+# Same per-file limit as the Streamlit app
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+EXPORT_MIME_TYPES = {
+    'txt': 'text/plain; charset=utf-8',
+    'json': 'application/json',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'pdf': 'application/pdf',
+    'searchable-pdf': 'application/pdf',
+}
+
+class Metrics:
+    """Request and page counters for /metrics"""
+
+    def __init__(self, window=60.0):
+        self.started = time.time()
+        self.window = window
+        self.requests = {}
+        self.errors = {}
+        self.latency = {}
+        self.pages_total = 0
+        self.in_flight = 0
+        self._page_times = deque()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.latency[endpoint] = self.latency.get(endpoint, 0.0) + seconds
+            if error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def add_pages(self, pages=1):
+        now = time.time()
+        with self._lock:
+            self.pages_total += pages
+            self._page_times.extend([now] * pages)
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            while self._page_times and self._page_times[0] < now - self.window:
+                self._page_times.popleft()
+            uptime = now - self.started
+            return {
+                'uptime_seconds': round(uptime, 1),
+                'in_flight': self.in_flight,
+                'pages_total': self.pages_total,
+                'pages_per_second': round(len(self._page_times) / min(self.window, max(uptime, 1e-6)), 3),
+                'requests': dict(self.requests),
+                'errors': dict(self.errors),
+                'mean_latency_ms': {endpoint: round(total / self.requests[endpoint] * 1000, 1)
+                                    for endpoint, total in self.latency.items()},
+            }
+
+class RequestError(Exception):
+    """A client error reported as HTTP 400"""
+
+# --- Work done in the pool processes -------------------------------------------
+
+def _init_worker():
+    # One OpenCV thread per process; the pool provides the parallelism
+    import cv2
+    cv2.setNumThreads(1)
+
+# Settings that may be negative (a rotation), and ones that must be above zero
+SIGNED_SETTINGS = ('deskew_angle',)
+POSITIVE_SETTINGS = ('max_dimension', 'analysis_dimension', 'gamma')
+
+def _settings(overrides):
+    """ImageSettings with query-string overrides converted to each field's type"""
+    from image_processor import ImageSettings
+    settings = ImageSettings()
+    fields = {name: value for name, value in vars(settings).items() if not name.startswith('_')}
+    for key, value in overrides.items():
+        current = fields.get(key)
+        if current is None or isinstance(current, (dict, tuple)):
+            raise RequestError(f"Unknown setting: {key}")
+        if isinstance(current, bool):
+            value = value.lower() in ('1', 'true', 'yes', 'on')
+        else:
+            try:
+                number = float(value)
+                if not math.isfinite(number):
+                    raise ValueError(value)
+                value = type(current)(number)
+            except (ValueError, OverflowError):
+                raise RequestError(f"Invalid value for {key}: {value}")
+            if (value < 0 and key not in SIGNED_SETTINGS) or (value <= 0 and key in POSITIVE_SETTINGS):
+                raise RequestError(f"Invalid value for {key}: {value}")
+        setattr(settings, key, value)
+    return settings
+
+def _source_bytes(data):
+    """Upload bytes, whether passed directly or through a shared memory block"""
+    if isinstance(data, ImageHandle):
+        return read_image(data).tobytes()
+    return data
+
+def _load_page(data, filename, page_index, max_dimension=None):
+    """PIL image for one page of an upload"""
+    from utils import load_image, load_pdf_page
+    if filename.lower().endswith('.pdf') or data[:5] == b'%PDF-':
+        return load_pdf_page(data, page_index)
+    import io
+    image = load_image(io.BytesIO(data), max_dimension)
+    return image.convert('RGB') if image.mode not in ('RGB', 'L') else image
+
+def count_pages(data, filename):
+    """Pages in an upload; images are checked here so undecodable ones fail before any work starts"""
+    data = _source_bytes(data)
+    if filename.lower().endswith('.pdf') or data[:5] == b'%PDF-':
+        from utils import pdf_page_count
+        return pdf_page_count(data)
+    import io
+    from utils import load_image
+    image = load_image(io.BytesIO(data))
+    try:
+        image.verify()
+    except Exception:
+        raise Exception("Error loading image. Please ensure it's a valid image file.")
+    return 1
+
+def process_page(data, filename, page_index, options, output=None):
+    """Enhance one page and return the requested outputs
+
+    With an output handle the page image for the text layer is written into
+    that shared memory block instead of being pickled back.
+    """
+    from image_processor import preprocess_image
+    data = _source_bytes(data)
+    settings = _settings(options.get('settings', {}))
+    enhance = options.get('enhance', True)
+    image = _load_page(data, filename, page_index, settings.max_dimension if enhance else None)
+    result = {}
+
+    if enhance:
+        image = preprocess_image(image, settings, auto_crop=options.get('auto_crop', True))[0][1]
+    if options.get('image_format'):
+        from export_handler import encode_image
+        result['image'] = encode_image(image, options['image_format'], options.get('quality', 95))
+    if options.get('ocr'):
+        from ocr_handler import read_document
+        document = read_document(image, text_layer=options.get('text_layer', False),
+                                 skip_ocr_with_symbols=options.get('skip_ocr_with_symbols', False))
+        if document['error'] is not None:
+            raise Exception(f"OCR Error: {document['error']}")
+        result['text'], result['symbols'] = document['text'], document['symbols']
+        if options.get('text_layer'):
+            result['text_layer'] = document['text_layer']
+            result['page'] = image
+            if output is not None:
+                import numpy as np
+                result['page'] = write_image(output, np.asarray(image)) or image
+    return result
+
+def detect_page(data, filename, page_index, options):
+    """Document corners in source pixels, plus the cropped page if asked for"""
+    import numpy as np
+    from image_processor import detect_document_corners, four_point_transform, order_points
+    image = _load_page(_source_bytes(data), filename, page_index)
+    image_array = np.asarray(image)
+    corners = detect_document_corners(image_array, _settings(options.get('settings', {})))
+    result = {'corners': None if corners is None else order_points(np.asarray(corners)).tolist(),
+              'width': image.size[0], 'height': image.size[1]}
+    if options.get('image_format') and corners is not None:
+        from PIL import Image
+        from export_handler import encode_image
+        cropped = Image.fromarray(four_point_transform(image_array, corners, auto_deskew=True))
+        result['image'] = encode_image(cropped, options['image_format'], options.get('quality', 95))
+    return result
+
+def _page_image(page):
+    """PIL page image from a process_page result, read from shared memory if it was put there"""
+    from PIL import Image
+    if isinstance(page['page'], ImageHandle):
+        return Image.fromarray(read_image(page['page']))
+    return page['page']
+
+def export_pages(pages, export_format, path=None, append=False):
+    """Build an export document from the per-page OCR results
+
+    Searchable PDFs are written to path (appended to it with append), and only
+    one page image is materialised at once.
+    """
+    from export_handler import (export_to_txt, export_to_json, export_to_excel,
+                                export_to_pdf, write_searchable_pdf)
+    if export_format == 'searchable-pdf':
+        write_searchable_pdf(((_page_image(page), page['text_layer']) for page in pages), path, append=append)
+        return path
+    text = '\n\n'.join(page['text'] for page in pages)
+    if export_format == 'txt':
+        return export_to_txt(text)
+    if export_format == 'json':
+        return export_to_json(text)
+    if export_format == 'xlsx':
+        return export_to_excel(text)
+    return export_to_pdf(text, _page_image(pages[0]) if len(pages) == 1 and 'page' in pages[0] else None)
+
+# --- HTTP layer -----------------------------------------------------------------
+
+def _options(request, **defaults):
+    """Split query parameters into pipeline options and ImageSettings overrides"""
+    params = dict(request.query_params)
+    options = dict(defaults)
+    for key, parse in (('format', str.upper), ('quality', int), ('auto_crop', None),
+                       ('enhance', None), ('crop', None), ('page', int), ('skip_ocr_with_symbols', None)):
+        if key in params:
+            value = params.pop(key)
+            try:
+                options[key] = parse(value) if parse else value.lower() in ('1', 'true', 'yes', 'on')
+            except ValueError:
+                raise RequestError(f"Invalid value for {key}: {value}")
+    options['settings'] = params
+    return options
+
+def _image_format(options, default='PNG'):
+    """The requested output image format, checked against the supported ones"""
+    from export_handler import IMAGE_MIME_TYPES
+    image_format = options.pop('format', default)
+    if image_format not in IMAGE_MIME_TYPES:
+        raise RequestError(f"Unsupported image format: {image_format}. "
+                           f"Use one of {', '.join(IMAGE_MIME_TYPES)}")
+    return image_format
+
+async def _uploads(request):
+    """(filename, bytes) for each file part; parts are spooled to disk while they stream in"""
+    form = await request.form(max_files=100)
+    uploads = []
+    for upload in form.getlist('file'):
+        if isinstance(upload, str):
+            raise RequestError("Form field 'file' must be a file upload")
+        if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+            raise RequestError(f"File {upload.filename} is too large. Maximum size is 10MB")
+        uploads.append((upload.filename or 'upload', await upload.read()))
+        await upload.close()
+    if not uploads:
+        raise RequestError("No file uploaded; send multipart/form-data with a 'file' part")
+    return uploads
+
+async def _run(request, function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app.state.executor, function, *args)
+
+def _share(request, data):
+    """Upload bytes placed in a shared memory block, or the bytes themselves if no block is free"""
+    import numpy as np
+    buffers = request.app.state.buffers
+    handle = buffers.acquire()
+    shared = write_image(handle, np.frombuffer(data, np.uint8))
+    if shared is None:
+        buffers.release(handle)
+        return data
+    return shared
+
+def _unshare(request, data):
+    if isinstance(data, ImageHandle):
+        request.app.state.buffers.release(data)
+
+def endpoint(name):
+    """Turn RequestError into 400, anything else into 500, and record metrics
+
+    Streamed responses are recorded when the stream ends; a handler marks one
+    failed by setting request.state.failed (e.g. when a page inside it failed).
+    """
+    def decorate(handler):
+        async def wrapper(request):
+            metrics = request.app.state.metrics
+            metrics.in_flight += 1
+            start = time.perf_counter()
+
+            def finish(failed):
+                metrics.in_flight -= 1
+                metrics.record(name, time.perf_counter() - start,
+                               failed or getattr(request.state, 'failed', False))
+
+            async def streamed(body):
+                failed = True
+                try:
+                    async for chunk in body:
+                        yield chunk
+                    failed = False
+                finally:
+                    finish(failed)
+
+            try:
+                response = await handler(request)
+            except RequestError as e:
+                finish(True)
+                return JSONResponse({'error': str(e)}, status_code=400)
+            except Exception as e:
+                finish(True)
+                return JSONResponse({'error': f"{name.title()} Error: {str(e)}"}, status_code=500)
+            except BaseException:
+                # Cancelled, e.g. the client went away mid-request
+                finish(True)
+                raise
+            if isinstance(response, StreamingResponse):
+                response.body_iterator = streamed(response.body_iterator)
+            else:
+                finish(False)
+            return response
+        return wrapper
+    return decorate
+
+async def _single_page(request):
+    filename, data = (await _uploads(request))[0]
+    options = _options(request)
+    page = options.get('page', 1)
+    try:
+        page_count = await _run(request, count_pages, data, filename)
+    except Exception as e:
+        raise RequestError(str(e))
+    if not 1 <= page <= page_count:
+        raise RequestError(f"Page {page} does not exist; {filename} has {page_count} page(s)")
+    return filename, data, page - 1, options
+
+@endpoint('enhance')
+async def enhance(request):
+    filename, data, page_index, options = await _single_page(request)
+    options['image_format'] = _image_format(options)
+    result = await _run(request, process_page, data, filename, page_index, options)
+    from export_handler import IMAGE_MIME_TYPES
+    request.app.state.metrics.add_pages()
+    return Response(result['image'], media_type=IMAGE_MIME_TYPES[options['image_format']])
+
+@endpoint('detect')
+async def detect(request):
+    filename, data, page_index, options = await _single_page(request)
+    if options.get('crop'):
+        options['image_format'] = _image_format(options)
+    result = await _run(request, detect_page, data, filename, page_index, options)
+    request.app.state.metrics.add_pages()
+    if 'image' in result:
+        from export_handler import IMAGE_MIME_TYPES
+        return Response(result['image'], media_type=IMAGE_MIME_TYPES[options['image_format']])
+    return JSONResponse(result)
+
+@endpoint('ocr')
+async def ocr(request):
+    filename, data, page_index, options = await _single_page(request)
+    options['ocr'] = True
+    result = await _run(request, process_page, data, filename, page_index, options)
+    request.app.state.metrics.add_pages()
+    return JSONResponse({'text': result['text'], 'symbols': result['symbols']})
+
+@endpoint('export')
+async def export(request):
+    """OCR every page and build one export document
+
+    Searchable PDFs are written a chunk of pages at a time: each chunk is
+    processed, appended to the output file by a worker and released before the
+    next starts, so neither process holds a long document's page images at once.
+    """
+    from export_handler import PDF_SAVE_CHUNK_PAGES
+    uploads = await _uploads(request)
+    options = _options(request)
+    export_format = options.pop('format', 'TXT').lower()
+    if export_format not in EXPORT_MIME_TYPES:
+        raise RequestError(f"Unsupported export format: {export_format}")
+    options['ocr'] = True
+    searchable = export_format == 'searchable-pdf'
+    buffers = request.app.state.buffers
+
+    # Text formats keep only each page's text; searchable PDFs keep the current chunk
+    pages, outputs, page_total, written = [], [], 0, False
+    path = None
+    if searchable:
+        fd, path = tempfile.mkstemp(prefix='export_', suffix='.pdf')
+        os.close(fd)
+
+    async def flush():
+        nonlocal pages, outputs, written
+        try:
+            await _run(request, export_pages, pages, export_format, path, written)
+            written = True
+        finally:
+            for output in outputs:
+                buffers.release(output)
+            pages, outputs = [], []
+
+    try:
+        for filename, data in uploads:
+            data = _share(request, data)
+            try:
+                try:
+                    page_count = await _run(request, count_pages, data, filename)
+                except Exception as e:
+                    raise RequestError(str(e))
+                # Page images are only needed for a searchable PDF, or a PDF export of one page
+                page_options = dict(options, text_layer=searchable or (
+                    export_format == 'pdf' and len(uploads) == 1 and page_count == 1))
+                start = 0
+                while start < page_count:
+                    end = min(page_count, start + PDF_SAVE_CHUNK_PAGES - len(pages)) if searchable else page_count
+                    page_outputs = [buffers.acquire() if searchable else None for _ in range(start, end)]
+                    outputs += [output for output in page_outputs if output is not None]
+                    # Let every page finish before any block is handed out again
+                    results = await asyncio.gather(*(
+                        _run(request, process_page, data, filename, page_index, page_options, output)
+                        for page_index, output in zip(range(start, end), page_outputs)
+                    ), return_exceptions=True)
+                    for result in results:
+                        if isinstance(result, Exception):
+                            raise result
+                    pages += results
+                    page_total += end - start
+                    start = end
+                    if searchable and len(pages) >= PDF_SAVE_CHUNK_PAGES:
+                        await flush()
+            finally:
+                _unshare(request, data)
+        if searchable:
+            if pages or not written:
+                await flush()
+        else:
+            document = await _run(request, export_pages, pages, export_format)
+    except BaseException:
+        if path is not None:
+            os.remove(path)
+        raise
+    finally:
+        for output in outputs:
+            buffers.release(output)
+    request.app.state.metrics.add_pages(page_total)
+    if searchable:
+        return FileResponse(path, media_type=EXPORT_MIME_TYPES[export_format],
+                            background=BackgroundTask(os.remove, path))
+    return Response(document, media_type=EXPORT_MIME_TYPES[export_format])
+
+@endpoint('batch')
+async def batch(request):
+    """Stream one JSON line per page, in completion order, as soon as each page is done"""
+    uploads = await _uploads(request)
+    options = _options(request, image_format=None, ocr=False)
+    options['image_format'] = _image_format(options)
+    options['ocr'] = request.query_params.get('ocr', 'false').lower() in ('1', 'true', 'yes', 'on')
+    options['settings'].pop('ocr', None)
+    workers = request.app.state.workers
+
+    # Each page job holds a reference to its file's shared upload block
+    jobs = []
+    for filename, data in uploads:
+        data = _share(request, data)
+        try:
+            page_count = await _run(request, count_pages, data, filename)
+        except Exception as e:
+            _unshare(request, data)
+            jobs.append((filename, None, None, e))
+            continue
+        for page_index in range(page_count):
+            if isinstance(data, ImageHandle):
+                request.app.state.buffers.retain(data)
+            jobs.append((filename, page_index, data, None))
+        _unshare(request, data)
+
+    async def run_job(job):
+        filename, page_index, data, error = job
+        line = {'file': filename, 'page': None if page_index is None else page_index + 1}
+        if error is None:
+            try:
+                result = await _run(request, process_page, data, filename, page_index, options)
+                request.app.state.metrics.add_pages()
+                line['image'] = base64.b64encode(result['image']).decode('ascii')
+                if 'text' in result:
+                    line['text'], line['symbols'] = result['text'], result['symbols']
+            except Exception as e:
+                error = e
+            finally:
+                _unshare(request, data)
+        if error is not None:
+            line['error'] = str(error)
+            request.state.failed = True
+        return line
+
+    async def lines():
+        # Keep only a couple of pages per worker in flight so results stream steadily
+        pending, queue = set(), iter(jobs)
+        try:
+            while True:
+                while len(pending) < 2 * workers:
+                    job = next(queue, None)
+                    if job is None:
+                        break
+                    pending.add(asyncio.ensure_future(run_job(job)))
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield json.dumps(task.result()) + '\n'
+        finally:
+            # A client that disconnects early leaves jobs that never ran
+            for filename, page_index, data, error in queue:
+                if error is None:
+                    _unshare(request, data)
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+async def health(request):
+    return JSONResponse({'status': 'ok'})
+
+async def metrics(request):
+    snapshot = request.app.state.metrics.snapshot()
+    snapshot['shared_memory'] = request.app.state.buffers.stats()
+    return JSONResponse(snapshot)
+
+def create_app(workers=None, shared_memory_mb=256):
+    workers = workers or os.cpu_count() or 1
+
+    async def lifespan(app):
+        from image_processor import ImageSettings
+        # One block holds an upload or a full-size enhanced page
+        block_size = max(MAX_UPLOAD_BYTES, block_size_for(ImageSettings().max_dimension))
+        app.state.workers = workers
+        app.state.metrics = Metrics()
+        app.state.buffers = BufferPool(block_size, max_blocks=shared_memory_mb * 1024 * 1024 // block_size)
+        app.state.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        try:
+            yield
+        finally:
+            app.state.executor.shutdown(cancel_futures=True)
+            app.state.buffers.close()
+
+    return Starlette(routes=[
+        Route('/v1/enhance', enhance, methods=['POST']),
+        Route('/v1/detect', detect, methods=['POST']),
+        Route('/v1/ocr', ocr, methods=['POST']),
+        Route('/v1/export', export, methods=['POST']),
+        Route('/v1/batch', batch, methods=['POST']),
+        Route('/health', health),
+        Route('/metrics', metrics),
+    ], lifespan=lifespan)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help="processing processes (default: CPU count)")
+    parser.add_argument('--shared-memory-mb', type=int, default=256,
+                        help="shared memory for passing pages to workers; 0 pickles everything")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(args.workers, args.shared_memory_mb), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import os
+import tempfile
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_processor import ImageSettings, detect_document_corners, preprocess_image
+
+def frame_sharpness(gray):
+    """Variance of the Laplacian, a cheap focus measure"""
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+def order_corners(corners):
+    """Corners sorted clockwise by angle around their centroid, starting nearest the top-left"""
+    corners = np.asarray(corners, dtype=np.float32).reshape(4, 2)
+    center = corners.mean(axis=0)
+    angles = np.arctan2(corners[:, 1] - center[1], corners[:, 0] - center[0])
+    corners = corners[np.argsort(angles)]
+    start = int(np.argmin(corners.sum(axis=1)))
+    return np.roll(corners, -start, axis=0)
+
+class DocumentTracker:
+    """Track a document quad across frames with optical flow between full detections"""
+
+    def __init__(self, settings=None, track_dimension=480, detect_interval=15):
+        self.settings = settings or ImageSettings()
+        self.track_dimension = track_dimension
+        self.detect_interval = detect_interval
+        self.corners = None
+        self.prev_gray = None
+        self.frames_since_detection = 0
+        self.scale = 1.0
+
+    def _detect(self, gray):
+        """Full corner detection on the small frame"""
+        corners = detect_document_corners(gray, self.settings)
+        if corners is None:
+            return None
+        area_ratio = cv2.contourArea(corners) / (gray.shape[0] * gray.shape[1])
+        if not 0.2 <= area_ratio <= 0.98:
+            return None
+        # boxPoints and contour approximations start at arbitrary corners; a fixed
+        # order keeps motion comparable with the tracked quad
+        return order_corners(corners)
+
+    def update(self, frame):
+        """Process one BGR frame; returns (corners in frame pixels or None, motion, small gray frame)
+
+        motion is the largest corner displacement since the previous frame as a
+        fraction of the frame diagonal, so it does not depend on the video resolution.
+        """
+        height, width = frame.shape[:2]
+        self.scale = min(1.0, self.track_dimension / max(height, width))
+        small = cv2.resize(frame, (int(width * self.scale), int(height * self.scale)),
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        motion = float('inf')
+        previous = self.corners
+
+        if previous is None or self.frames_since_detection >= self.detect_interval:
+            # Periodic full detection keeps the tracked quad from drifting
+            self.corners = self._detect(gray)
+            self.frames_since_detection = 0
+        else:
+            tracked, status, _ = cv2.calcOpticalFlowPyrLK(
+                self.prev_gray, gray, previous.reshape(-1, 1, 2), None,
+                winSize=(21, 21), maxLevel=3,
+                criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+            )
+            if status is not None and status.all():
+                self.corners = tracked.reshape(4, 2)
+                self.frames_since_detection += 1
+            else:
+                self.corners = self._detect(gray)
+                self.frames_since_detection = 0
+
+        if previous is not None and self.corners is not None:
+            displacement = np.linalg.norm(self.corners - previous, axis=1).max()
+            motion = float(displacement / np.hypot(*gray.shape[:2]))
+
+        self.prev_gray = gray
+
+        if self.corners is None:
+            return None, motion, gray
+        return self.corners / self.scale, motion, gray
+
+def capture_document(source, settings=None, min_sharpness=100.0, stable_frames=8,
+                     max_motion=0.002, max_frames=None, stop_when_stable=None):
+    """Capture the sharpest stable document view from a video file or camera index
+
+    max_motion is the corner movement per frame, as a fraction of the frame
+    diagonal, below which a frame counts as stable (about 3 pixels at 720p).
+    """
+    if settings is None:
+        settings = ImageSettings()
+
+    # Live cameras trigger on the first stable run, recordings are scanned to the end
+    if stop_when_stable is None:
+        stop_when_stable = isinstance(source, int)
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise Exception(f"Could not open video source: {source}")
+
+    tracker = DocumentTracker(settings)
+    stable_run = deque(maxlen=stable_frames)
+    best = None
+    frame_count = 0
+    start = time.perf_counter()
+
+    try:
+        while max_frames is None or frame_count < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frame_count += 1
+
+            corners, motion, gray = tracker.update(frame)
+            sharpness = frame_sharpness(gray)
+
+            # Blurry, moving or untracked frames break the stable run
+            if corners is None or sharpness < min_sharpness or motion > max_motion:
+                stable_run.clear()
+                continue
+
+            # Sharpness discounted by residual motion, so a steadier frame wins over
+            # one that only just passed the threshold
+            score = sharpness / (1.0 + motion / max_motion)
+            stable_run.append((score, sharpness, frame_count, frame, corners))
+            if len(stable_run) < stable_frames:
+                continue
+
+            # Keep the best frame seen in any long enough stable run
+            candidate = max(stable_run, key=lambda item: item[0])
+            if best is None or candidate[0] > best[0]:
+                best = candidate
+            if stop_when_stable:
+                break
+    finally:
+        capture.release()
+
+    elapsed = time.perf_counter() - start
+    if best is None:
+        return None
+
+    _, sharpness, frame_index, frame, corners = best
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    enhanced_versions = preprocess_image(Image.fromarray(frame_rgb), settings, corners=corners)
+
+    return {
+        'enhanced_versions': enhanced_versions,
+        'frame_index': frame_index,
+        'corners': corners,
+        'sharpness': sharpness,
+        'frames_processed': frame_count,
+        'tracking_fps': frame_count / elapsed if elapsed > 0 else 0.0,
+    }
+
+def capture_from_upload(uploaded_file, settings=None):
+    """Run capture_document on an uploaded video file"""
+    suffix = os.path.splitext(uploaded_file.name)[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
+        temp_file.write(uploaded_file.getvalue())
+        temp_path = temp_file.name
+
+    try:
+        result = capture_document(temp_path, settings)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if result is None:
+        raise Exception("No sharp, steady document found in the video.")
+    return result
@@ -0,0 +1,216 @@
+"""Compare quality and speed of processing configurations on synthetic slips.
+
+Run with: python evaluation.py [--samples N] [--seed S] [--update-golden]
+Each slip is rendered from known text, then photographed synthetically
+(skew, perspective, blur, noise, uneven lighting). Every configuration is
+scored by SSIM against the golden enhanced output and by character error
+rate of the OCR text against the ground truth, next to its timings.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_processor import ImageSettings, preprocess_image
+
+# Setting overrides per configuration; 'default' produces the golden outputs
+CONFIGURATIONS = {
+    'default': {},
+    'auto-tune': {'auto_tune': True},
+    'no-denoise': {'noise_reduction': False},
+    'no-clahe': {'clahe_clip_limit': 0},
+    'no-shadow': {'shadow_reduction': 0},
+    'strong-shadow': {'shadow_reduction': 0.8},
+    'bw': {'bw_mode': True},
+    'max-1200px': {'max_dimension': 1200},
+}
+
+GOLDEN_CONFIGURATION = 'default'
+
+_ITEMS = ('MILK', 'BREAD', 'EGGS', 'RICE', 'TEA', 'SUGAR', 'SOAP', 'OIL', 'SALT', 'FLOUR', 'BUTTER', 'APPLES')
+
+def _slip_text(rng):
+    """Receipt-like lines with a total that matches the items"""
+    lines = [f"STORE {rng.integers(100, 999)}", f"BILL NO {rng.integers(10000, 99999)}"]
+    total = 0
+    for _ in range(rng.integers(5, 10)):
+        quantity, price = int(rng.integers(1, 5)), int(rng.integers(10, 500))
+        total += quantity * price
+        lines.append(f"{rng.choice(_ITEMS)} {quantity} X {price}.00")
+    lines.append(f"TOTAL {total}.00")
+    return lines
+
+def _render_slip(lines, width=1000, line_height=70):
+    """Flat, clean rendering of the slip text"""
+    height = line_height * (len(lines) + 2)
+    slip = np.full((height, width, 3), 240, np.uint8)
+    for index, line in enumerate(lines, start=1):
+        cv2.putText(slip, line, (60, index * line_height + 20), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.3, (25, 25, 25), 2, cv2.LINE_AA)
+    return slip
+
+def _photograph(slip, rng):
+    """Place the slip in a larger scene as a phone camera would capture it"""
+    height, width = slip.shape[:2]
+    scene_width, scene_height = int(width * 1.5), int(height * 1.4)
+    background = np.full((scene_height, scene_width, 3), rng.integers(30, 90), np.uint8)
+
+    # Skew plus independent corner jitter gives rotation and perspective
+    angle = np.deg2rad(rng.uniform(-8, 8))
+    center = np.array([scene_width / 2, scene_height / 2])
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    corners = np.array([[-width, -height], [width, -height], [width, height], [-width, height]]) / 2
+    jitter = rng.uniform(-0.04, 0.04, (4, 2)) * [width, height]
+    destination = (corners + jitter) @ rotation.T + center
+    M = cv2.getPerspectiveTransform(
+        np.float32([[0, 0], [width, 0], [width, height], [0, height]]), np.float32(destination))
+    cv2.warpPerspective(slip, M, (scene_width, scene_height), dst=background,
+                        borderMode=cv2.BORDER_TRANSPARENT)
+
+    # Uneven lighting falling off from one side
+    gradient = np.linspace(rng.uniform(0.7, 0.9), 1.0, scene_width, dtype=np.float32)
+    if rng.random() < 0.5:
+        gradient = gradient[::-1]
+    photo = background.astype(np.float32) * gradient[None, :, None]
+
+    blur = rng.uniform(0, 1.5)
+    if blur > 0.3:
+        photo = cv2.GaussianBlur(photo, (0, 0), blur)
+    photo += rng.normal(0, rng.uniform(0, 10), photo.shape)
+    return np.clip(photo, 0, 255).astype(np.uint8)
+
+def generate_corpus(samples=12, seed=0):
+    """Synthetic slips with ground-truth text, reproducible from the seed"""
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for index in range(samples):
+        lines = _slip_text(rng)
+        corpus.append({
+            'name': f"slip_{seed}_{index:03d}",
+            'text': '\n'.join(lines),
+            'image': Image.fromarray(_photograph(_render_slip(lines), rng)),
+        })
+    return corpus
+
+def character_error_rate(reference, hypothesis):
+    """Levenshtein distance between the texts, ignoring layout whitespace, over the reference length"""
+    reference, hypothesis = ' '.join(reference.split()), ' '.join(hypothesis.split())
+    if not reference:
+        return float(bool(hypothesis))
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, start=1):
+        current = [i]
+        for j, hyp_char in enumerate(hypothesis, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ref_char != hyp_char)))
+        previous = current
+    return previous[-1] / len(reference)
+
+def ssim(image_a, image_b):
+    """Mean structural similarity of two images in greyscale"""
+    def gray(image):
+        image = np.asarray(image)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        return image.astype(np.float64)
+
+    a, b = gray(image_a), gray(image_b)
+    if a.shape != b.shape:
+        b = cv2.resize(b, (a.shape[1], a.shape[0]), interpolation=cv2.INTER_AREA)
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    covariance = blur(a * b) - mu_a * mu_b
+    score = ((2 * mu_a * mu_b + c1) * (2 * covariance + c2)) / \
+            ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(score.mean())
+
+def make_settings(overrides):
+    settings = ImageSettings()
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    return settings
+
+def _load_ocr():
+    """extract_text if Tesseract is usable here, otherwise None"""
+    try:
+        import pytesseract
+        from ocr_handler import extract_text, _configure_tesseract
+        _configure_tesseract()
+        pytesseract.get_tesseract_version()
+        return extract_text
+    except Exception as e:
+        print(f"OCR unavailable, skipping character error rate ({e})")
+        return None
+
+def evaluate(corpus, configurations, golden_dir, update_golden=False, ocr=None):
+    """Run every configuration over the corpus and collect per-configuration metrics"""
+    golden = {}
+    results = {}
+    for name, overrides in configurations.items():
+        settings = make_settings(overrides)
+        metrics = {'process': [], 'ocr': [], 'ssim': [], 'cer': []}
+        for sample in corpus:
+            start = time.perf_counter()
+            enhanced = preprocess_image(sample['image'], settings)[0][1]
+            metrics['process'].append(time.perf_counter() - start)
+
+            golden_path = os.path.join(golden_dir, f"{sample['name']}.png")
+            if name == GOLDEN_CONFIGURATION:
+                if update_golden:
+                    os.makedirs(golden_dir, exist_ok=True)
+                    enhanced.save(golden_path)
+                # Without stored goldens, score against this run's default output
+                golden[sample['name']] = Image.open(golden_path) if os.path.exists(golden_path) else enhanced
+            if sample['name'] in golden:
+                metrics['ssim'].append(ssim(golden[sample['name']], enhanced))
+
+            if ocr is not None:
+                start = time.perf_counter()
+                text = ocr(enhanced)
+                metrics['ocr'].append(time.perf_counter() - start)
+                metrics['cer'].append(character_error_rate(sample['text'], text))
+        results[name] = metrics
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=12, help="synthetic slips to generate")
+    parser.add_argument('--seed', type=int, default=0, help="corpus random seed")
+    parser.add_argument('--golden-dir', default='evaluation_golden', help="where golden outputs are kept")
+    parser.add_argument('--update-golden', action='store_true',
+                        help=f"store the '{GOLDEN_CONFIGURATION}' outputs as the new goldens")
+    parser.add_argument('--no-ocr', action='store_true', help="skip OCR and character error rate")
+    parser.add_argument('--config', action='append', choices=sorted(CONFIGURATIONS),
+                        help="configuration to evaluate (repeatable, default all)")
+    args = parser.parse_args()
+
+    names = args.config or list(CONFIGURATIONS)
+    if GOLDEN_CONFIGURATION not in names:
+        names.insert(0, GOLDEN_CONFIGURATION)
+    configurations = {name: CONFIGURATIONS[name] for name in names}
+
+    corpus = generate_corpus(args.samples, args.seed)
+    ocr = None if args.no_ocr else _load_ocr()
+    if not os.path.isdir(args.golden_dir) and not args.update_golden:
+        print(f"No goldens in {args.golden_dir}; SSIM is relative to this run's '{GOLDEN_CONFIGURATION}' output")
+    results = evaluate(corpus, configurations, args.golden_dir, args.update_golden, ocr)
+
+    def median(values, scale=1.0, digits=3):
+        return f"{statistics.median(values) * scale:.{digits}f}" if values else 'n/a'
+
+    print(f"{'configuration':<14} {'process ms':>10} {'ocr ms':>8} {'ssim':>6} {'min ssim':>8} {'cer':>6}")
+    for name, metrics in results.items():
+        print(f"{name:<14} {median(metrics['process'], 1000, 0):>10} {median(metrics['ocr'], 1000, 0):>8} "
+              f"{median(metrics['ssim']):>6} {min(metrics['ssim'], default=float('nan')):>8.3f} "
+              f"{median(metrics['cer']):>6}")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,67 @@
 
 import json
+import os
+import tempfile
 from fpdf import FPDF
 import io
+import cv2
+import numpy as np
 from PIL import Image
 
+# MIME types of the supported page output formats
+IMAGE_MIME_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'AVIF': 'image/avif',
+    'PDF': 'application/pdf',
+}
+
+# Quality targets for compressed PDF exports
+PDF_COMPRESSION_PRESETS = {
+    'high': {'jpeg_quality': 85, 'background_scale': 0.5},
+    'medium': {'jpeg_quality': 70, 'background_scale': 0.33},
+    'low': {'jpeg_quality': 50, 'background_scale': 0.25},
+}
+
+def encode_image(image, image_format, quality=95):
+    """Encode a processed page with the fastest suitable encoder for the format"""
+    if image_format == 'PDF':
+        buffer = io.BytesIO()
+        image.save(buffer, format='PDF', resolution=300, quality=quality)
+        return buffer.getvalue()
+
+    # OpenCV encoders work on BGR arrays and release the GIL
+    image_array = np.asarray(image)
+    if image_array.ndim == 3:
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+
+    if image_format == 'PNG':
+        # Level 1 is several times faster than the default for a few percent in size
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+    elif image_format == 'JPEG':
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif image_format == 'WEBP':
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif image_format == 'AVIF':
+        # OpenCV builds before 4.10 have no AVIF quality flag and usually no encoder
+        params = [cv2.IMWRITE_AVIF_QUALITY, quality] if hasattr(cv2, 'IMWRITE_AVIF_QUALITY') else None
+    else:
+        raise ValueError(f"Unsupported output format: {image_format}")
+
+    if params is not None:
+        try:
+            ok, encoded = cv2.imencode(f".{image_format.lower()}", image_array, params)
+            if ok:
+                return encoded.tobytes()
+        except cv2.error:
+            pass
+
+    # Fall back to Pillow when this OpenCV build lacks the codec
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
 def export_to_txt(text):
     """Export extracted text to TXT format"""
     return text.encode()
@@ -74,60 +132,237 @@ def export_to_json(text):
     }
     return json.dumps(data, ensure_ascii=False, indent=2).encode()
 
+def _text_lines(text):
+    """Non-empty, stripped lines of extracted text"""
+    return [line.strip() for line in text.split('\n') if line.strip()]
+
+def _sheet_title(name, used_titles):
+    """Valid, unique worksheet title (at most 31 characters, no []:*?/\\)"""
+    title = ''.join('_' if char in '[]:*?/\\' else char for char in name)[:31] or 'Sheet'
+    candidate, counter = title, 2
+    while candidate.lower() in used_titles:
+        suffix = f" ({counter})"
+        candidate = title[:31 - len(suffix)] + suffix
+        counter += 1
+    used_titles.add(candidate.lower())
+    return candidate
+
 def export_to_excel(text):
     """Export extracted text to Excel format"""
-    import pandas as pd
-    import io
-    
-    # Split text into lines and create a DataFrame
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    df = pd.DataFrame({'Extracted Text': lines})
-    
-    # Create Excel file in memory
+    return export_batch_to_excel([('Extracted Text', text)])
+
+def export_batch_to_excel(documents, consolidated=False):
+    """Stream (name, text) pairs into a workbook: one sheet per document, or one combined table"""
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+    # Write-only workbooks stream rows instead of keeping every cell in memory
+    workbook = Workbook(write_only=True)
+
+    if consolidated:
+        sheet = workbook.create_sheet('Extracted Text')
+        sheet.append(['Document', 'Line', 'Extracted Text'])
+        for name, text in documents:
+            for line_number, line in enumerate(_text_lines(text), start=1):
+                sheet.append([name, line_number, ILLEGAL_CHARACTERS_RE.sub('', line)])
+    else:
+        used_titles = set()
+        for name, text in documents:
+            sheet = workbook.create_sheet(_sheet_title(name, used_titles))
+            sheet.append(['Extracted Text'])
+            for line in _text_lines(text):
+                sheet.append([ILLEGAL_CHARACTERS_RE.sub('', line)])
+        if not used_titles:
+            # A workbook without sheets is reported as corrupt by Excel
+            workbook.create_sheet('Extracted Text').append(['Extracted Text'])
+
     excel_buffer = io.BytesIO()
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Extracted Text')
-    
+    workbook.save(excel_buffer)
     return excel_buffer.getvalue()
 
-def merge_images_to_pdf(images):
-    """Merge multiple images into a single PDF"""
+def is_text_only(image):
+    """Check whether a page is essentially dark text on a light, colourless background"""
+    image_array = np.asarray(image)
+    if image_array.ndim == 3:
+        small = cv2.resize(image_array, (256, 256), interpolation=cv2.INTER_AREA)
+        lab = cv2.cvtColor(small, cv2.COLOR_RGB2LAB)
+        chroma = np.abs(lab[..., 1:].astype(np.int16) - 128).mean()
+        if chroma > 6:
+            return False
+        gray = lab[..., 0]
+    else:
+        gray = cv2.resize(image_array, (256, 256), interpolation=cv2.INTER_AREA)
+
+    # Photos have many mid tones, text pages are mostly paper or ink
+    mid_tones = np.count_nonzero((gray > 70) & (gray < 180)) / gray.size
+    return mid_tones < 0.08
+
+def _text_mask(image):
+    """Binarize a page into a text mask (True where ink is)"""
+    image_array = np.asarray(image)
+    if image_array.ndim == 3:
+        gray = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = image_array
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY, 31, 15)
+    return binary == 0
+
+def _insert_g4_image(pdf, mask, stencil=False):
+    """Embed a boolean ink mask as a CCITT Group 4 image XObject and return its xref"""
+    height, width = mask.shape
+    bilevel = Image.fromarray(np.where(mask, 0, 255).astype(np.uint8)).convert('1')
+
+    # Encode as a single-strip G4 TIFF and lift the raw fax data out of it
+    tiff_buffer = io.BytesIO()
+    bilevel.save(tiff_buffer, format='TIFF', compression='group4', tiffinfo={278: height})
+    tiff = Image.open(io.BytesIO(tiff_buffer.getvalue()))
+    offset, length = tiff.tag_v2[273][0], tiff.tag_v2[279][0]
+    fax_data = tiff_buffer.getvalue()[offset:offset + length]
+
+    xref = pdf.get_new_xref()
+    pdf.update_object(xref, "<<>>")
+    pdf.update_stream(xref, fax_data, compress=False)
+    pdf.xref_set_key(xref, "Type", "/XObject")
+    pdf.xref_set_key(xref, "Subtype", "/Image")
+    pdf.xref_set_key(xref, "Width", str(width))
+    pdf.xref_set_key(xref, "Height", str(height))
+    pdf.xref_set_key(xref, "BitsPerComponent", "1")
+    pdf.xref_set_key(xref, "Filter", "/CCITTFaxDecode")
+    pdf.xref_set_key(xref, "DecodeParms", f"<</K -1 /Columns {width} /Rows {height} /BlackIs1 true>>")
+    if stencil:
+        # Paint the ink pixels with the current fill colour (black)
+        pdf.xref_set_key(xref, "ImageMask", "true")
+    else:
+        pdf.xref_set_key(xref, "ColorSpace", "/DeviceGray")
+    return xref
+
+def _insert_page_image(pdf, page, rect, image, compression='lossless', quality='medium', bw_mode=False):
+    """Place a page image using the requested compression mode"""
+    preset = PDF_COMPRESSION_PRESETS[quality]
+
+    if compression == 'auto':
+        if bw_mode or image.mode in ('1', 'L') or is_text_only(image):
+            compression = 'bilevel'
+        else:
+            compression = 'mrc'
+
+    if compression == 'bilevel':
+        page.insert_image(rect, xref=_insert_g4_image(pdf, _text_mask(image)))
+        return
+
+    image_buffer = io.BytesIO()
+    if compression == 'mrc':
+        # Low resolution background with the text painted out, sharp G4 text on top
+        image_array = np.asarray(image.convert('RGB'))
+        mask = _text_mask(image_array)
+        height, width = mask.shape
+        scale = preset['background_scale']
+        small_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        background = cv2.resize(image_array, small_size, interpolation=cv2.INTER_AREA)
+        small_mask = cv2.resize(mask.astype(np.uint8) * 255, small_size, interpolation=cv2.INTER_AREA)
+        small_mask = cv2.dilate((small_mask > 0).astype(np.uint8) * 255, np.ones((3, 3), np.uint8))
+        background = cv2.inpaint(background, small_mask, 3, cv2.INPAINT_TELEA)
+        Image.fromarray(background).save(image_buffer, format='JPEG', quality=preset['jpeg_quality'], optimize=True)
+        page.insert_image(rect, stream=image_buffer.getvalue())
+        page.insert_image(rect, xref=_insert_g4_image(pdf, mask, stencil=True))
+    elif compression == 'jpeg':
+        image.convert('RGB').save(image_buffer, format='JPEG', quality=preset['jpeg_quality'], optimize=True)
+        page.insert_image(rect, stream=image_buffer.getvalue())
+    else:
+        image.save(image_buffer, format='PNG')
+        page.insert_image(rect, stream=image_buffer.getvalue())
+
+# Pages added between saves when writing a PDF to disk; only the pages since the
+# last save are held in memory, so long documents do not grow the process
+PDF_SAVE_CHUNK_PAGES = 20
+
+def _flush_pdf(pdf, path, saved):
+    """Save the pages added so far and reopen the file so they can be dropped from memory"""
+    import pymupdf
+    if saved:
+        pdf.save(path, incremental=True, encryption=pymupdf.PDF_ENCRYPT_KEEP, deflate=True)
+    else:
+        pdf.save(path, garbage=3, deflate=True)
+    pdf.close()
+    return pymupdf.open(path)
+
+def write_searchable_pdf(pages, path, dpi=200, compression='lossless', quality='medium', bw_mode=False,
+                         append=False):
+    """Write a searchable PDF from (image, text_layer) pairs to path, a chunk of pages at a time
+
+    With append the pages are added to the end of the PDF already at path.
+    """
     try:
-        pdf = FPDF()
-        import os
-        
-        # Create unique temporary files for each image
-        temp_files = []
-        for idx, image in enumerate(images):
-            temp_img_path = f"temp_image_{idx}.png"
-            temp_files.append(temp_img_path)
-            image.save(temp_img_path, format='PNG')
-            
-            pdf.add_page()
-            
-            # Calculate dimensions
-            page_width = pdf.w - 2 * pdf.l_margin
-            page_height = pdf.h - 2 * pdf.t_margin
+        import pymupdf
+    except ImportError:
+        raise Exception("Searchable PDF export requires PyMuPDF. Install it with 'pip install pymupdf'.")
 
+    pdf = None
+    try:
+        pdf = pymupdf.open(path) if append else pymupdf.open()
+        saved, pending = append, 0
+        for image, text_layer in pages:
+            # Page size follows the image at the given resolution
             img_width, img_height = image.size
-            width_ratio = page_width / img_width
-            height_ratio = page_height / img_height
-            scale = min(width_ratio, height_ratio)
+            page = pdf.new_page(width=img_width * 72 / dpi, height=img_height * 72 / dpi)
+
+            _insert_page_image(pdf, page, page.rect, image, compression, quality, bw_mode)
+
+            # Overlay Tesseract's invisible text-only page, stretched to the image
+            if text_layer:
+                with pymupdf.open(stream=text_layer, filetype="pdf") as layer:
+                    page.show_pdf_page(page.rect, layer, 0, keep_proportion=False)
+
+            page = None
+            pending += 1
+            if pending == PDF_SAVE_CHUNK_PAGES:
+                pdf = _flush_pdf(pdf, path, saved)
+                saved, pending = True, 0
+        if pending or not saved:
+            pdf = _flush_pdf(pdf, path, saved)
+    except Exception as e:
+        raise Exception(f"Searchable PDF Error: {str(e)}")
+    finally:
+        if pdf is not None:
+            pdf.close()
 
+def export_to_searchable_pdf(pages, dpi=200, compression='lossless', quality='medium', bw_mode=False):
+    """Build a searchable PDF from (image, text_layer) pairs and return its bytes"""
+    with tempfile.TemporaryDirectory(prefix='pdf_') as temp_dir:
+        path = os.path.join(temp_dir, 'searchable.pdf')
+        write_searchable_pdf(pages, path, dpi, compression, quality, bw_mode)
+        with open(path, 'rb') as f:
+            return f.read()
+
+def merge_images_to_pdf(images, compression='lossless', quality='medium', bw_mode=False):
+    """Merge multiple images into a single PDF"""
+    try:
+        import pymupdf
+    except ImportError:
+        raise Exception("PDF merging requires PyMuPDF. Install it with 'pip install pymupdf'.")
+
+    try:
+        pdf = pymupdf.open()
+        margin = 10 / 25.4 * 72
+
+        for image in images:
+            # A4 page with the image centred inside the margins
+            page = pdf.new_page(width=595.28, height=841.89)
+            page_width = page.rect.width - 2 * margin
+            page_height = page.rect.height - 2 * margin
+
+            img_width, img_height = image.size
+            scale = min(page_width / img_width, page_height / img_height)
             new_width = img_width * scale
             new_height = img_height * scale
 
-            # Center image on page
-            x = (page_width - new_width) / 2 + pdf.l_margin
-            y = (page_height - new_height) / 2 + pdf.t_margin
-
-            pdf.image(temp_img_path, x=x, y=y, w=new_width)
+            x = (page_width - new_width) / 2 + margin
+            y = (page_height - new_height) / 2 + margin
+            rect = pymupdf.Rect(x, y, x + new_width, y + new_height)
 
-        # Clean up all temporary files
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+            _insert_page_image(pdf, page, rect, image, compression, quality, bw_mode)
 
-        return pdf.output(dest='S').encode('latin-1', errors='ignore')
+        return pdf.tobytes(garbage=3, deflate=True)
     except Exception as e:
         raise Exception(f"PDF Merge Error: {str(e)}")
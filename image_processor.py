@@ -1,6 +1,12 @@
+import copy
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance
+from PIL import Image
+
+from resources import get_clahe, get_thread_resource
 
 class ImageSettings:
     def __init__(self):
@@ -32,6 +38,10 @@ class ImageSettings:
         self.bw_mode = False
         self.detail_enhancement = 1.0
 
+        # Pick enhancement stages per image from analyze_image statistics
+        self.auto_tune = False
+        self.analysis_dimension = 512
+
 def order_points(pts):
     """Order points in clockwise order: top-left, top-right, bottom-right, bottom-left"""
     rect = np.zeros((4, 2), dtype="float32")
@@ -43,101 +53,514 @@ def order_points(pts):
     rect[3] = pts[np.argmax(diff)]
     return rect
 
-def four_point_transform(image, pts):
-    """Apply perspective transform to get top-down view"""
-    rect = order_points(pts)
-    (tl, tr, br, bl) = rect
+def _projection_skew(binary, max_angle=15.0):
+    """Coarse-to-fine projection-profile search for the text skew of a binary image"""
+    coords = cv2.findNonZero(binary)
+    if coords is None or len(coords) < 50:
+        return 0.0
+
+    points = coords.reshape(-1, 2).astype(np.float32)
+    height, width = binary.shape[:2]
+    center = (width / 2, height / 2)
+    bins = int(np.hypot(width, height)) + 2
+
+    def score(angle):
+        # Project ink pixels onto the rows of the image rotated by -angle
+        M = cv2.getRotationMatrix2D(center, -angle, 1.0)
+        rows = points[:, 0] * M[1, 0] + points[:, 1] * M[1, 1] + M[1, 2] - center[1] + bins / 2
+        hist = np.bincount(np.clip(rows, 0, bins - 1).astype(np.int32), minlength=bins)
+        return float(np.dot(hist, hist))
+
+    coarse = np.arange(-max_angle, max_angle + 0.5, 1.0)
+    best = max(coarse, key=score)
+    fine = np.arange(max(best - 1.0, -max_angle), min(best + 1.0, max_angle) + 0.05, 0.1)
+    return float(max(fine, key=score))
+
+def estimate_skew_angle(image_array, max_angle=15.0, sample_dimension=800):
+    """Estimate the counter-clockwise rotation of text lines in degrees"""
+    if len(image_array.shape) == 3:
+        gray = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = image_array
+
+    # Work on a downscaled, binarized copy
+    height, width = gray.shape[:2]
+    scale = min(1.0, sample_dimension / max(height, width))
+    if scale < 1.0:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    return _projection_skew(binary, max_angle)
+
+def _rotation_homography(width, height, angle):
+    """Rotation about the image center as a 3x3 matrix, with the canvas grown to fit"""
+    M = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    cos, sin = abs(M[0, 0]), abs(M[0, 1])
+    new_width = int(round(height * sin + width * cos))
+    new_height = int(round(height * cos + width * sin))
+    M[0, 2] += new_width / 2 - width / 2
+    M[1, 2] += new_height / 2 - height / 2
+    return np.vstack([M, [0, 0, 1]]), (new_width, new_height)
+
+def plan_geometry(image_shape, corners=None, angle=0.0, max_dimension=None):
+    """Compose crop, deskew rotation and downscale into one homography from source pixels"""
+    height, width = image_shape[:2]
+
+    if corners is not None:
+        rect = order_points(corners)
+        (tl, tr, br, bl) = rect
+
+        # Compute size of the top-down view
+        widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
+        widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
+        maxWidth = max(int(widthA), int(widthB))
+        heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
+        heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
+        maxHeight = max(int(heightA), int(heightB))
+
+        dst = np.array([
+            [0, 0],
+            [maxWidth - 1, 0],
+            [maxWidth - 1, maxHeight - 1],
+            [0, maxHeight - 1]], dtype="float32")
+        M = cv2.getPerspectiveTransform(rect, dst)
+        size = (maxWidth, maxHeight)
+    else:
+        M = np.eye(3)
+        size = (width, height)
+
+    # Fold the deskew rotation in
+    if abs(angle) >= 0.25:
+        R, size = _rotation_homography(size[0], size[1], angle)
+        M = R @ M
+
+    # Scale straight to the final output size
+    if max_dimension and max(size) > max_dimension:
+        scale = max_dimension / max(size)
+        M = np.diag([scale, scale, 1.0]) @ M
+        size = (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+
+    return M, size
+
+def warp_geometry(image_array, M, size):
+    """Resample the source once through a homography from plan_geometry"""
+    height, width = image_array.shape[:2]
+
+    # Pure scaling (no crop, no rotation) is a plain area resize
+    if np.allclose(M[[0, 1, 2, 2], [1, 0, 0, 1]], 0) and np.allclose(M[:2, 2], 0):
+        if size == (width, height):
+            return image_array
+        return cv2.resize(image_array, size, interpolation=cv2.INTER_AREA)
+
+    # Heavy downscales are first reduced by area averaging so the warp does not alias
+    scale = np.sqrt(abs(np.linalg.det(M[:2, :2])))
+    if scale < 0.5:
+        reduction = 2 * scale
+        reduced_size = (max(1, int(width * reduction)), max(1, int(height * reduction)))
+        image_array = cv2.resize(image_array, reduced_size, interpolation=cv2.INTER_AREA)
+        M = M @ np.diag([width / reduced_size[0], height / reduced_size[1], 1.0])
+
+    return cv2.warpPerspective(image_array, M, size, flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_REPLICATE)
+
+def deskew_image(image_array, angle):
+    """Rotate the image by angle degrees (counter-clockwise) in a single warp"""
+    M, size = plan_geometry(image_array.shape, angle=angle)
+    return warp_geometry(image_array, M, size)
+
+def four_point_transform(image, pts, angle=0.0, auto_deskew=False):
+    """Apply perspective transform to get top-down view, optionally deskewing in the same warp"""
+    # Estimate residual skew on a small preview of the warp
+    if auto_deskew:
+        preview_M, preview_size = plan_geometry(image.shape, pts, max_dimension=800)
+        preview = cv2.warpPerspective(image, preview_M, preview_size)
+        angle -= estimate_skew_angle(preview)
+
+    M, size = plan_geometry(image.shape, pts, angle)
+    warped = warp_geometry(image, M, size)
 
-    # Compute width of new image
-    widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
-    widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
-    maxWidth = max(int(widthA), int(widthB))
-
-    # Compute height of new image
-    heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
-    heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
-    maxHeight = max(int(heightA), int(heightB))
+    return warped
 
-    # Construct set of destination points
-    dst = np.array([
-        [0, 0],
-        [maxWidth - 1, 0],
-        [maxWidth - 1, maxHeight - 1],
-        [0, maxHeight - 1]], dtype="float32")
+def analyze_image(image_array, sample_dimension=512):
+    """Compute cheap quality statistics on a downscaled copy of the image"""
+    height, width = image_array.shape[:2]
+    scale = min(1.0, sample_dimension / max(height, width))
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    if len(image_array.shape) == 3:
+        gray_full = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+    else:
+        gray_full = image_array
+
+    # Area sampling for global statistics, nearest sampling keeps pixel noise intact
+    gray = cv2.resize(gray_full, size, interpolation=cv2.INTER_AREA)
+    gray_nearest = cv2.resize(gray_full, size, interpolation=cv2.INTER_NEAREST)
+
+    # Histogram statistics
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    cdf = np.cumsum(hist) / max(hist.sum(), 1)
+    low = int(np.searchsorted(cdf, 0.01))
+    high = int(np.searchsorted(cdf, 0.99))
+    mean, std = cv2.meanStdDev(gray)
+
+    # Noise sigma (Immerkaer's operator, median based so text edges do not count as noise)
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    response = cv2.filter2D(gray_nearest.astype(np.float32), -1, kernel)
+    inner = np.abs(response[1:-1, 1:-1])
+    noise = float(np.median(inner) / (0.6745 * 6)) if inner.size else 0.0
+
+    # Blur (variance of Laplacian)
+    blur = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+    # Colorfulness (mean chroma in the sample)
+    colorfulness = 0.0
+    if len(image_array.shape) == 3:
+        small = cv2.resize(image_array, size, interpolation=cv2.INTER_AREA).astype(np.int16)
+        rg = small[..., 0] - small[..., 1]
+        yb = (small[..., 0] + small[..., 1]) // 2 - small[..., 2]
+        colorfulness = float(np.sqrt(rg.std() ** 2 + yb.std() ** 2) + 0.3 * np.sqrt(rg.mean() ** 2 + yb.mean() ** 2))
+
+    # Skew from the projection profile of the dark (ink) pixels
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    skew = _projection_skew(binary)
+
+    return {
+        'mean': float(mean[0][0]),
+        'std': float(std[0][0]),
+        'low': low,
+        'high': high,
+        'dynamic_range': high - low,
+        'noise': noise,
+        'blur': blur,
+        'colorfulness': colorfulness,
+        'skew': skew,
+    }
 
-    # Calculate perspective transform matrix and apply it
-    M = cv2.getPerspectiveTransform(rect, dst)
-    warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
+def auto_tune_settings(image_array, settings=None):
+    """Choose enhancement stages and parameters for one image from its statistics"""
+    if settings is None:
+        settings = ImageSettings()
 
-    return warped
+    stats = analyze_image(image_array, settings.analysis_dimension)
+    tuned = copy.deepcopy(settings)
+
+    # Denoise only when there is measurable sensor noise
+    tuned.noise_reduction = stats['noise'] > 2.5
+    if tuned.noise_reduction:
+        tuned.denoise_strength = int(np.clip(round(stats['noise'] * 2.5), 3, 20))
+
+    # Stretch contrast only for washed-out images
+    if stats['dynamic_range'] >= 200:
+        tuned.contrast = 1.0
+    else:
+        tuned.contrast = min(max(200 / max(stats['dynamic_range'], 1), 1.0), settings.contrast)
+
+    # Brighten towards a paper-white mean, leave well exposed scans alone
+    target_mean = 170.0
+    brightness = min(max(target_mean / max(stats['mean'], 1), 0.8), settings.brightness)
+    tuned.brightness = 1.0 if abs(brightness - 1.0) < 0.05 else brightness
+
+    # Sharpen only soft images
+    if stats['blur'] > 500:
+        tuned.sharpness = 1.0
+    elif stats['blur'] < 100:
+        tuned.sharpness = max(settings.sharpness, 1.6)
+
+    # Saturation has no effect on grey documents
+    if stats['colorfulness'] < 10:
+        tuned.saturation = 1.0
+
+    # Local contrast equalisation is unnecessary for high contrast scans
+    if stats['dynamic_range'] >= 220 and stats['std'] >= 60:
+        tuned.clahe_clip_limit = 0
+
+    return tuned, stats
+
+# PIL's ImageEnhance.Sharpness blends with this smoothing kernel
+_SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+
+def _scratch(name, shape, dtype=np.uint8):
+    """Per-thread scratch buffer reused across pages of the same size"""
+    buffers = get_thread_resource('enhance_scratch', dict)
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = buffers[name] = np.empty(shape, dtype)
+    return buffer
+
+def _tunes_tone(settings):
+    """Whether contrast, brightness and sharpness are applied
+
+    Before auto-tune each PIL enhancer wrapped the colour-balanced image and
+    only the last one (Color) reached the output. Plain settings keep that
+    look; the chained adjustments apply only when auto-tune picks them.
+    """
+    return settings.auto_tune
+
+def _tone_luts(image, settings):
+    """Fold colour balance, contrast and brightness into one lookup table per channel"""
+    levels = np.arange(256, dtype=np.float32)
+    if image.ndim == 2:
+        # Greyscale images had their colour balance applied on conversion
+        balances, weights = (1.0,), (1.0,)
+    else:
+        balances = tuple(settings.color_balance[channel] for channel in ('red', 'green', 'blue'))
+        weights = (0.299, 0.587, 0.114)
+    luts = [np.clip(np.floor(levels * balance + 0.5), 0, 255) for balance in balances]
+
+    if _tunes_tone(settings) and settings.contrast != 1.0:
+        # Contrast pivots on the mean grey level, as ImageEnhance.Contrast does
+        pixels = image.shape[0] * image.shape[1]
+        mean = sum(
+            weight * float(cv2.calcHist([image], [channel], None, [256], [0, 256]).ravel() @ luts[channel]) / pixels
+            for channel, weight in enumerate(weights)
+        )
+        mean = int(mean + 0.5)
+        luts = [np.clip(mean + settings.contrast * (lut - mean), 0, 255) for lut in luts]
+
+    if _tunes_tone(settings) and settings.brightness != 1.0:
+        luts = [np.clip(lut * settings.brightness, 0, 255) for lut in luts]
+
+    return np.dstack(luts).astype(np.uint8) if image.ndim == 3 else luts[0].astype(np.uint8)
+
+def _new_output(image, out):
+    return np.empty(image.shape, np.uint8) if out is None else out
+
+def _shadow_stage(image, settings, out):
+    """Flatten uneven lighting by dividing out a low-resolution estimate of the paper brightness"""
+    strength = settings.shadow_reduction
+    if strength <= 0:
+        return image
+
+    height, width = image.shape[:2]
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=_scratch('gray', (height, width)))
+
+    # Closing on a small copy wipes out the dark text and leaves the illumination
+    scale = min(1.0, 256 / max(height, width))
+    small = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))),
+                       interpolation=cv2.INTER_AREA)
+    kernel_size = max(3, max(small.shape) // 16 | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    background = cv2.medianBlur(cv2.morphologyEx(small, cv2.MORPH_CLOSE, kernel), 5)
+
+    # Partial strength divides by background**strength, rescaled so white paper stays white
+    background = 255 * (np.maximum(background, 1) / 255.0) ** strength
+    background = cv2.resize(background.astype(np.uint8), (width, height),
+                            dst=_scratch('shadow_background', (height, width)),
+                            interpolation=cv2.INTER_LINEAR)
+    if image.ndim == 3:
+        background = cv2.cvtColor(background, cv2.COLOR_GRAY2RGB, dst=_scratch('shadow_background_rgb', image.shape))
+    return cv2.divide(image, background, scale=255, dst=_new_output(image, out))
+
+def _denoise_stage(image, settings, out):
+    if not (settings.noise_reduction and settings.denoise_strength > 0):
+        return image
+    # Non-local means cannot run in place
+    out = np.empty(image.shape, np.uint8) if out is None or out is image else out
+    cv2.fastNlMeansDenoisingColored(image, out, settings.denoise_strength, settings.denoise_strength)
+    return out
+
+def _tone_stage(image, settings, out):
+    # Colour balance, contrast and brightness are per-pixel, so one LUT pass does all three
+    tuned = _tunes_tone(settings) and (settings.contrast != 1.0 or settings.brightness != 1.0)
+    if not tuned and (image.ndim == 2 or all(value == 1.0 for value in settings.color_balance.values())):
+        return image
+    return cv2.LUT(image, _tone_luts(image, settings), dst=_new_output(image, out))
+
+def _sharpen_stage(image, settings, out):
+    # Sharpness blends with a smoothed copy
+    if not _tunes_tone(settings) or settings.sharpness == 1.0:
+        return image
+    smooth = _scratch('smooth', image.shape)
+    cv2.filter2D(image, -1, _SMOOTH_KERNEL, dst=smooth, borderType=cv2.BORDER_REPLICATE)
+    return cv2.addWeighted(image, settings.sharpness, smooth, 1 - settings.sharpness, 0,
+                           dst=_new_output(image, out))
+
+def _saturate_stage(image, settings, out):
+    # Saturation blends with the greyscale image
+    if settings.saturation == 1.0:
+        return image
+    gray = _scratch('gray', image.shape[:2])
+    gray_rgb = _scratch('gray_rgb', image.shape)
+    cv2.cvtColor(image, cv2.COLOR_RGB2GRAY, dst=gray)
+    cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB, dst=gray_rgb)
+    return cv2.addWeighted(image, settings.saturation, gray_rgb, 1 - settings.saturation, 0,
+                           dst=_new_output(image, out))
+
+def _clahe_stage(image, settings, out):
+    # CLAHE on the lightness channel
+    if settings.clahe_clip_limit <= 0:
+        return image
+    lab = _scratch('lab', image.shape)
+    lightness = _scratch('lightness', image.shape[:2])
+    cv2.cvtColor(image, cv2.COLOR_RGB2LAB, dst=lab)
+    cv2.extractChannel(lab, 0, dst=lightness)
+    clahe = get_clahe(settings.clahe_clip_limit, settings.clahe_grid_size)
+    clahe.apply(lightness, dst=lightness)
+    cv2.insertChannel(lightness, lab, 0)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2RGB, dst=_new_output(image, out))
+
+def _edge_stage(image, settings, out):
+    if settings.edge_enhancement <= 1.0:
+        return image
+    edges = _scratch('edges', image.shape)
+    cv2.Laplacian(image, cv2.CV_8U, dst=edges)
+    return cv2.addWeighted(image, 1, edges, settings.edge_enhancement - 1, 0,
+                           dst=_new_output(image, out))
+
+def _gray_stage(image, settings, out):
+    """Convert to greyscale once, folding the colour balance into the channel weights"""
+    if image.ndim == 2:
+        return image
+    balance = settings.color_balance
+    weights = np.array([[0.299 * balance['red'], 0.587 * balance['green'], 0.114 * balance['blue']]],
+                       dtype=np.float32)
+    return cv2.transform(image, weights)
+
+def _gray_denoise_stage(image, settings, out):
+    if not (settings.noise_reduction and settings.denoise_strength > 0):
+        return image
+    out = np.empty(image.shape, np.uint8) if out is None or out is image else out
+    cv2.fastNlMeansDenoising(image, out, settings.denoise_strength)
+    return out
+
+def _gray_clahe_stage(image, settings, out):
+    # The grey image is already the luminance, so no LAB round trip
+    if settings.clahe_clip_limit <= 0:
+        return image
+    clahe = get_clahe(settings.clahe_clip_limit, settings.clahe_grid_size)
+    return clahe.apply(image, dst=_new_output(image, out))
+
+def _binarize_stage(image, settings, out):
+    """Adaptive threshold, robust to uneven lighting across the page"""
+    block_size = max(31, min(image.shape[:2]) // 40 | 1)
+    return cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                 block_size, 15, dst=_new_output(image, out))
+
+# Enhancement stages in order, with the ImageSettings fields each one reads.
+# A stage writes into out when given one, otherwise into a new array, and
+# returns its input unchanged when its settings make it a no-op.
+ENHANCE_STAGES = (
+    ('shadow', ('shadow_reduction',), _shadow_stage),
+    ('denoise', ('noise_reduction', 'denoise_strength'), _denoise_stage),
+    ('tone', ('color_balance', 'contrast', 'brightness', 'auto_tune'), _tone_stage),
+    ('sharpen', ('sharpness', 'auto_tune'), _sharpen_stage),
+    ('saturate', ('saturation',), _saturate_stage),
+    ('clahe', ('clahe_clip_limit', 'clahe_grid_size'), _clahe_stage),
+    ('edges', ('edge_enhancement',), _edge_stage),
+)
+
+# Black and white output works on one channel from the start
+BW_ENHANCE_STAGES = (
+    ('gray', ('color_balance',), _gray_stage),
+    ('gray_shadow', ('shadow_reduction',), _shadow_stage),
+    ('gray_denoise', ('noise_reduction', 'denoise_strength'), _gray_denoise_stage),
+    ('gray_tone', ('contrast', 'brightness', 'auto_tune'), _tone_stage),
+    ('gray_sharpen', ('sharpness', 'auto_tune'), _sharpen_stage),
+    ('gray_clahe', ('clahe_clip_limit', 'clahe_grid_size'), _gray_clahe_stage),
+    ('gray_edges', ('edge_enhancement',), _edge_stage),
+    ('binarize', (), _binarize_stage),
+)
+
+# Stage outputs a StageCache keeps. Denoising is the one expensive stage; the
+# cheap tone, CLAHE and edge stages after it rerun from its output, so an
+# image costs two cached arrays (geometry and denoise) instead of one per stage
+CACHED_STAGES = frozenset(('denoise', 'gray_denoise'))
+
+def _settings_key(settings, fields):
+    """Hashable snapshot of the given settings fields"""
+    values = []
+    for field in fields:
+        value = getattr(settings, field)
+        if isinstance(value, dict):
+            value = tuple(sorted(value.items()))
+        elif isinstance(value, list):
+            value = tuple(value)
+        values.append(value)
+    return tuple(values)
+
+class StageCache:
+    """Intermediate results of preprocess_image for one source image
+
+    Each stored output is kept with the settings it was computed from,
+    including everything upstream, so a changed setting only reruns the work
+    after the last stored output it does not affect.
+    """
 
-def enhance_image(image_array, settings=None):
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def run(self, name, key, function):
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        output = function()
+        self.entries[name] = (key, output)
+        return output
+
+    @property
+    def nbytes(self):
+        """Memory held by the stored arrays, counting shared ones once"""
+        arrays = {id(output): output for _, output in self.entries.values() if isinstance(output, np.ndarray)}
+        return sum(array.nbytes for array in arrays.values())
+
+def enhance_image(image_array, settings=None, cache=None, upstream_key=()):
+    """Run the enhancement stages on an RGB array without leaving NumPy
+
+    With bw_mode the whole chain runs on one channel and ends in adaptive
+    binarization. The input is never modified. Without a cache the stages share one newly
+    allocated output array; with a StageCache each stage keeps its own output
+    so unchanged stages are reused on the next call.
+    """
     if settings is None:
         settings = ImageSettings()
 
-    # Convert to PIL Image for enhancement chain
-    image_pil = Image.fromarray(image_array)
-    
-    # Apply denoising if enabled
-    if settings.noise_reduction:
-        image_array = cv2.fastNlMeansDenoisingColored(
-            np.array(image_pil), 
-            None, 
-            settings.denoise_strength, 
-            settings.denoise_strength
-        )
-        image_pil = Image.fromarray(image_array)
-
-    # Apply color balance
-    r, g, b = image_pil.split()
-    r = r.point(lambda x: x * settings.color_balance['red'])
-    g = g.point(lambda x: x * settings.color_balance['green'])
-    b = b.point(lambda x: x * settings.color_balance['blue'])
-    image_pil = Image.merge('RGB', (r, g, b))
-
-    # Apply basic enhancements
-    enhancers = {
-        'Contrast': ImageEnhance.Contrast(image_pil),
-        'Brightness': ImageEnhance.Brightness(image_pil),
-        'Sharpness': ImageEnhance.Sharpness(image_pil),
-        'Color': ImageEnhance.Color(image_pil)
-    }
-    
-    image_pil = enhancers['Contrast'].enhance(settings.contrast)
-    image_pil = enhancers['Brightness'].enhance(settings.brightness)
-    image_pil = enhancers['Sharpness'].enhance(settings.sharpness)
-    image_pil = enhancers['Color'].enhance(settings.saturation)
-
-    # Convert to LAB for CLAHE
-    image_array = np.array(image_pil)
-    lab = cv2.cvtColor(image_array, cv2.COLOR_RGB2LAB)
-    l, a, b = cv2.split(lab)
-    
-    clahe = cv2.createCLAHE(
-        clipLimit=settings.clahe_clip_limit, 
-        tileGridSize=settings.clahe_grid_size
-    )
-    cl = clahe.apply(l)
-    
-    # Merge back
-    limg = cv2.merge((cl, a, b))
-    enhanced = cv2.cvtColor(limg, cv2.COLOR_LAB2RGB)
-    
-    # Convert to black and white if enabled
-    if settings.bw_mode:
-        enhanced_pil = Image.fromarray(enhanced).convert('L')
-        enhanced = np.array(enhanced_pil)
-        
-    # Apply edge enhancement if needed
-    if settings.edge_enhancement > 1.0:
-        edge_enhanced = cv2.Laplacian(enhanced, cv2.CV_8U)
-        enhanced = cv2.addWeighted(
-            enhanced, 1, 
-            edge_enhanced, settings.edge_enhancement - 1, 
-            0
-        )
-    
-    return enhanced
+    if image_array.ndim == 3 and image_array.shape[2] == 4:
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
+    elif image_array.ndim == 2 and not settings.bw_mode:
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_GRAY2RGB)
+
+    image = image_array
+    key = upstream_key
+    for name, fields, stage in BW_ENHANCE_STAGES if settings.bw_mode else ENHANCE_STAGES:
+        if cache is None:
+            # Once the input has been copied, later stages work in place
+            image = stage(image, settings, None if image is image_array else image)
+        else:
+            key = key + _settings_key(settings, fields)
+            if name in CACHED_STAGES:
+                image = cache.run(name, key, lambda: stage(image, settings, None))
+            else:
+                # Never write into an array the cache holds
+                image = stage(image, settings, None)
+
+    # Never hand back the caller's array
+    return image_array.copy() if image is image_array else image
+
+def _document_edge_map(image_array, settings):
+    """Dilated Canny edge map used to find document outlines"""
+    # Convert to grayscale if needed
+    if len(image_array.shape) == 3:
+        gray = cv2.cvtColor(image_array.astype(np.uint8), cv2.COLOR_RGB2GRAY)
+    else:
+        gray = image_array.astype(np.uint8)
+
+    # Apply Gaussian blur to reduce noise
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+
+    # Edge detection with custom settings
+    edges = cv2.Canny(blurred, settings.canny_low, settings.canny_high)
+
+    # Dilate edges to connect components
+    kernel = np.ones((3,3), np.uint8)
+    edges = cv2.dilate(edges, kernel, iterations=1)
+
+    # Dilate edges to connect components
+    kernel = np.ones((5,5), np.uint8)
+    return cv2.dilate(edges, kernel, iterations=2)
 
 def detect_document_corners(image_array, settings=None):
     """Detect document corners using edge detection and contour finding"""
@@ -149,35 +572,7 @@ def detect_document_corners(image_array, settings=None):
         if image_array is None or not isinstance(image_array, np.ndarray):
             return None
 
-        # Convert to grayscale if needed
-        if len(image_array.shape) == 3:
-            gray = cv2.cvtColor(image_array.astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        else:
-            gray = image_array.astype(np.uint8)
-
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-
-        # Use Canny edge detection with automatic threshold
-        median = np.median(blurred)
-        sigma = 0.33
-        lower = int(max(0, (1.0 - sigma) * median))
-        upper = int(min(255, (1.0 + sigma) * median))
-        edges = cv2.Canny(blurred, lower, upper) 
-        #The following lines were causing an error and were removed as they were not present in the original code
-        #cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        #cv2.THRESH_BINARY, 11, 2)
-
-        # Edge detection with custom settings
-        edges = cv2.Canny(blurred, settings.canny_low, settings.canny_high)
-
-        # Dilate edges to connect components
-        kernel = np.ones((3,3), np.uint8)
-        edges = cv2.dilate(edges, kernel, iterations=1)
-
-        # Dilate edges to connect components
-        kernel = np.ones((5,5), np.uint8)
-        dilated = cv2.dilate(edges, kernel, iterations=2)
+        dilated = _document_edge_map(image_array, settings)
         
         # Find contours
         contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -191,7 +586,7 @@ def detect_document_corners(image_array, settings=None):
         # Get the minimum area rectangle
         rect = cv2.minAreaRect(largest_contour)
         box = cv2.boxPoints(rect)
-        box = np.int0(box)
+        box = np.intp(box)
         
         # Convert to float32 for perspective transform
         return box.astype(np.float32)
@@ -200,6 +595,50 @@ def detect_document_corners(image_array, settings=None):
         print(f"Error during contour processing: {e}")
         return None
 
+def detect_document_regions(image_array, settings=None, max_regions=10, min_area_ratio=0.02):
+    """Detect every plausible document quadrilateral, returned as (corners, score) best first"""
+    try:
+        if settings is None:
+            settings = ImageSettings()
+
+        # Input validation
+        if image_array is None or not isinstance(image_array, np.ndarray):
+            return []
+
+        dilated = _document_edge_map(image_array, settings)
+        contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        image_area = image_array.shape[0] * image_array.shape[1]
+
+        regions = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area < min_area_ratio * image_area or area > 0.98 * image_area:
+                continue
+
+            # Prefer a true quadrilateral, fall back to the minimum area rectangle
+            peri = cv2.arcLength(contour, True)
+            approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
+            if len(approx) == 4 and cv2.isContourConvex(approx):
+                quad = approx.reshape(4, 2).astype(np.float32)
+                shape_score = 1.0
+            else:
+                quad = cv2.boxPoints(cv2.minAreaRect(contour)).astype(np.float32)
+                shape_score = 0.8
+
+            # Score by how well the quad fits the outline and by relative size
+            quad_area = cv2.contourArea(quad)
+            if quad_area <= 0:
+                continue
+            fill = min(area / quad_area, 1.0)
+            size_score = min(1.0, np.sqrt(area / image_area) * 3)
+            regions.append((quad, float(shape_score * fill * size_score)))
+
+        regions.sort(key=lambda region: region[1], reverse=True)
+        return regions[:max_regions]
+
+    except Exception as e:
+        print(f"Error during contour processing: {e}")
+        return []
 
 def auto_process_image(image_path):
     """Automatically process an image and save with the same filename"""
@@ -219,11 +658,12 @@ def auto_process_image(image_path):
 
         if corners is not None:
             # It's a document - apply perspective transform
-            warped = four_point_transform(image_array, corners)
+            warped = four_point_transform(image_array, corners, auto_deskew=True)
             enhanced = enhance_image(warped)
         else:
-            # Not a document - just enhance
-            enhanced = enhance_image(image_array)
+            # Not a document - straighten and enhance
+            straightened = deskew_image(image_array, -estimate_skew_angle(image_array))
+            enhanced = enhance_image(straightened)
 
         # Convert back to PIL Image
         result_image = Image.fromarray(enhanced)
@@ -236,28 +676,105 @@ def auto_process_image(image_path):
         print(f"Error processing {image_path}: {str(e)}")
         return False
 
-def preprocess_image(pil_image, settings=None, auto_crop=True):
+def _plan_document_geometry(image_array, settings, auto_crop, corners):
+    """Detect the document and plan the transform that crops, deskews and resizes it"""
+    # Detection and skew estimation run on a small analysis copy
+    original_height, original_width = image_array.shape[:2]
+    analysis_scale = min(1.0, 1000 / max(original_height, original_width))
+    if analysis_scale < 1.0:
+        analysis = cv2.resize(
+            image_array,
+            (int(original_width * analysis_scale), int(original_height * analysis_scale)),
+            interpolation=cv2.INTER_AREA
+        )
+    else:
+        analysis = image_array
+
+    # Corners already known (e.g. tracked in a video) are given in source pixels
+    if corners is not None:
+        corners = np.asarray(corners, dtype=np.float32) * analysis_scale
+
+    # Find the document outline, ignoring implausibly small or full-frame boxes
+    elif auto_crop:
+        detected = detect_document_corners(analysis, settings)
+        if detected is not None:
+            area_ratio = cv2.contourArea(detected) / (analysis.shape[0] * analysis.shape[1])
+            if 0.2 <= area_ratio <= 0.98:
+                corners = detected
+
+    # Straighten skewed text
+    angle = settings.deskew_angle
+    if settings.auto_rotate:
+        preview_M, preview_size = plan_geometry(analysis.shape, corners, max_dimension=800)
+        angle -= estimate_skew_angle(warp_geometry(analysis, preview_M, preview_size))
+
+    if corners is not None:
+        corners = corners / analysis_scale
+    return plan_geometry(image_array.shape, corners, angle, settings.max_dimension)
+
+def preprocess_image(pil_image, settings=None, auto_crop=True, corners=None, cache=None):
+    """Crop, straighten and enhance a photo; pass a StageCache to reuse unchanged stages"""
     if settings is None:
         settings = ImageSettings()
 
     # Convert PIL image to numpy array
-    image_array = np.array(pil_image)
-
-    # Store original dimensions
-    original_height, original_width = image_array.shape[:2]
+    image_array = np.asarray(pil_image)
+
+    # Crop, deskew and resize in a single resample of the source pixels
+    if cache is None:
+        M, size = _plan_document_geometry(image_array, settings, auto_crop, corners)
+        image_array = warp_geometry(image_array, M, size)
+        geometry_key = ()
+    else:
+        plan_key = (
+            auto_crop, None if corners is None else tuple(np.asarray(corners, dtype=np.float32).ravel()),
+            settings.canny_low, settings.canny_high, settings.auto_rotate,
+            settings.deskew_angle, settings.max_dimension
+        )
+        M, size = cache.run('plan', plan_key,
+                            lambda: _plan_document_geometry(image_array, settings, auto_crop, corners))
+        # Later stages depend on the planned transform, so detection tweaks that
+        # land on the same crop keep the enhanced stages
+        geometry_key = (M.tobytes(), size)
+        image_array = cache.run('geometry', geometry_key, lambda: warp_geometry(image_array, M, size))
 
-    # Resize if image is too large
-    if max(original_height, original_width) > settings.max_dimension:
-        scale = settings.max_dimension / max(original_height, original_width)
-        new_width = int(original_width * scale)
-        new_height = int(original_height * scale)
-        image_array = cv2.resize(image_array, (new_width, new_height))
+    # Tune the enhancement chain to this image
+    if settings.auto_tune:
+        settings, _ = auto_tune_settings(image_array, settings)
 
     # Enhance the image
-    enhanced = enhance_image(image_array, settings)
+    enhanced = enhance_image(image_array, settings, cache, geometry_key)
     enhanced_pil = Image.fromarray(enhanced)
 
     return [
         ("Enhanced", enhanced_pil),
         ("Original", pil_image)
-    ]
\ No newline at end of file
+    ]
+
+def split_documents(pil_image, settings=None, min_score=0.3, max_workers=None):
+    """Detect several documents in one photo and process each region in parallel"""
+    if settings is None:
+        settings = ImageSettings()
+
+    image_array = np.asarray(pil_image)
+
+    # Detect on a small copy, then map the quads back to source pixels
+    height, width = image_array.shape[:2]
+    scale = min(1.0, 1000 / max(height, width))
+    analysis = cv2.resize(image_array, (int(width * scale), int(height * scale)),
+                          interpolation=cv2.INTER_AREA) if scale < 1.0 else image_array
+    regions = [(quad / scale, score)
+               for quad, score in detect_document_regions(analysis, settings)
+               if score >= min_score]
+
+    if not regions:
+        return []
+
+    # OpenCV releases the GIL, so threads give real parallelism here
+    workers = max_workers or min(len(regions), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda region: preprocess_image(image_array, settings, corners=region[0])[0],
+            regions
+        )
+        return [(quad, score, enhanced) for (quad, score), enhanced in zip(regions, results)]
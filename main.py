@@ -16,14 +16,16 @@ st.set_page_config(
     })
 
 from PIL import Image
-from image_processor import preprocess_image, ImageSettings
-from utils import load_image, show_error
+from utils import load_image, iter_pdf_pages, VIDEO_EXTENSIONS
+from resources import get_resource, prewarm
 import io
 import zipfile
 import time
 import base64
 from datetime import datetime
 import os
+import threading
+from contextlib import contextmanager
 
 # Custom CSS for better styling
 st.markdown("""
@@ -167,96 +169,93 @@ def get_image_download_link(img, filename, text):
     return href
 
 
-import json
 import os
-
-def load_settings():
-    """Load saved settings from cache file or use defaults"""
-    settings_file = 'settings_cache.json'
-    default_settings = {
-        'contrast': 1.3,
-        'brightness': 1.15,
-        'sharpness': 1.4,
-        'saturation': 1.2,
-        'clahe_limit': 3.5,
-        'red_balance': 1.0,
-        'green_balance': 1.0,
-        'blue_balance': 1.0,
-        'denoise': 10,
-        'gamma': 1.0,
-        'edge_enhance': 1.0,
-        'detail_enhance': 1.0,
-        'bw_mode': False,
-        'auto_deskew': True,
-    }
-
-    # Try to load from Streamlit session state first
-    if all(f"settings_{key}" in st.session_state for key in default_settings.keys()):
-        loaded_settings = {key: st.session_state[f"settings_{key}"] for key in default_settings.keys()}
-        st.session_state.user_settings = loaded_settings
-        return loaded_settings
-
-    # Try to load from Replit Object Storage
+import uuid
+
+def show_error(error_message):
+    """Display error message in both English and Hindi"""
+    st.error(f"""
+    🚫 Error (त्रुटि):
+    
+    English: {error_message}
+    
+    Hindi: कृपया सही फ़ाइल अपलोड करें और पुनः प्रयास करें।
+    """)
+
+def get_settings_store():
+    """Process-wide settings profile store"""
+    from settings_store import SettingsStore, default_backend
+    return get_resource('settings_store', lambda: SettingsStore(default_backend()))
+
+def get_admission():
+    """Process-wide admission controller that shares the CPU between sessions"""
+    from admission import AdmissionController
+    return get_resource('admission', AdmissionController)
+
+def get_session_id():
+    """Id of this browser session, the unit of fair scheduling"""
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+def show_queue_position(placeholder, position, waiting):
+    """Tell the user where their next heavy job is while it waits for the CPU"""
+    if position:
+        placeholder.info(f"⏳ Server busy: your next page is #{position} in line ({waiting} waiting)")
+    else:
+        placeholder.empty()
+
+@contextmanager
+def admitted_in_script(stage, size=None, parallelism=1):
+    """Hold a share of the CPU budget for work done on the script thread, showing the queue position meanwhile"""
+    from admission import estimate_cost
+    queue_status = st.empty()
     try:
-        from replit.object_storage import Client
-        storage_client = Client()
-        stored_settings = storage_client.download_as_json("user_settings.json")
-        if stored_settings:
-            default_settings.update(stored_settings)
-            st.session_state.user_settings = default_settings
-            return default_settings
-    except:
-        pass  # Fall back to local file if Object Storage fails
-
-    # Try to load from local file
+        with get_admission().admit(get_session_id(), estimate_cost(stage, size, parallelism),
+                                   on_wait=lambda *position: show_queue_position(queue_status, *position)):
+            queue_status.empty()
+            yield
+    finally:
+        queue_status.empty()
+
+def get_user_id():
+    """Signed-in user's e-mail, otherwise a per-browser id kept in the URL"""
+    if 'user_id' in st.session_state:
+        return st.session_state.user_id
+
+    user_id = None
     try:
-        if os.path.exists(settings_file):
-            with open(settings_file, 'r') as f:
-                saved_settings = json.load(f)
-                default_settings.update(saved_settings)
-                st.session_state.user_settings = default_settings
-                return default_settings
-    except Exception as e:
-        print(f"Error loading settings: {e}")
-
-    # Use defaults if all else fails
-    st.session_state.user_settings = default_settings
-    return default_settings
-
+        if st.user.is_logged_in:
+            user_id = st.user.email
+    except Exception:
+        pass
+
+    if not user_id:
+        user_id = st.query_params.get('uid')
+        if not user_id:
+            user_id = uuid.uuid4().hex
+            st.query_params['uid'] = user_id
+
+    st.session_state.user_id = user_id
+    return user_id
+
+def load_settings(profile=None):
+    """Load the active settings profile for the current user (a memory read after the first load)"""
+    from settings_store import DEFAULT_PROFILE
+    profile = profile or st.session_state.get('settings_profile', DEFAULT_PROFILE)
+    settings = get_settings_store().get(get_user_id(), profile)
+    st.session_state.settings_profile = profile
+    st.session_state.user_settings = settings
+    return settings
+
+def save_settings(settings, profile=None):
+    """Save settings to the active profile; persistence happens in the background"""
     try:
-        if os.path.exists('settings_cache.json'):
-            with open('settings_cache.json', 'r') as f:
-                saved_settings = json.load(f)
-                default_settings.update(saved_settings)
-    except Exception as e:
-        print(f"Error loading settings: {e}")
-
-    # Always update session state with latest settings
-    st.session_state.user_settings = default_settings
-
-    # Initialize slider values in session state
-    for key, value in default_settings.items():
-        if key not in st.session_state:
-            st.session_state[key] = value
-
-    return default_settings
-
-def save_settings(settings):
-    """Save current settings to cache file and session state"""
-    try:
-        # Update session state first
+        profile = profile or st.session_state.settings_profile
         st.session_state.user_settings = settings
-
-        # Save to file
-        with open('settings_cache.json', 'w') as f:
-            json.dump(settings, f, indent=4)
-            f.flush()
-            os.fsync(f.fileno())
-
+        st.session_state.settings_profile = profile
+        get_settings_store().save(get_user_id(), profile, settings)
         st.success("✅ Settings saved successfully!")
-
-        # Force Streamlit to rerun with new settings
-        st.rerun()
     except Exception as e:
         st.error(f"Error saving settings: {str(e)}")
 
@@ -270,9 +269,28 @@ def init_session_state():
         st.session_state.current_page = 'upload'
     if 'processing_error' not in st.session_state:
         st.session_state.processing_error = None
+    if 'ocr_results' not in st.session_state:
+        st.session_state.ocr_results = {}
+    if 'symbol_results' not in st.session_state:
+        st.session_state.symbol_results = {}
+    if 'stage_caches' not in st.session_state:
+        st.session_state.stage_caches = {}
     if 'user_settings' not in st.session_state:
         st.session_state.user_settings = load_settings()
 
+# Memory per session for intermediate enhancement results kept for quick reprocessing
+STAGE_CACHE_BYTES = 64 * 1024 * 1024
+
+def get_stage_cache(caches, key):
+    """StageCache for one image, evicting the least recently used beyond STAGE_CACHE_BYTES"""
+    from image_processor import StageCache
+    cache = caches.pop(key, None) or StageCache()
+    caches[key] = cache
+    # Always keep the requested cache, however large
+    while len(caches) > 1 and sum(cached.nbytes for cached in caches.values()) > STAGE_CACHE_BYTES:
+        caches.pop(next(iter(caches)))
+    return cache
+
 
 def main():
     # Initialize all session state variables
@@ -340,31 +358,20 @@ def main():
                 st.session_state.processed_images = []
             if 'processing_error' in st.session_state:
                 st.session_state.processing_error = None
+            if 'ocr_results' in st.session_state:
+                st.session_state.ocr_results = {}
+            if 'symbol_results' in st.session_state:
+                st.session_state.symbol_results = {}
             st.success("✅ All images cleared successfully!")
             time.sleep(1)  # Give user time to see the success message
             st.rerun()
 
         # Reset settings button
         if st.button("↩️ Reset to Default Settings", use_container_width=True):
-            default_settings = {
-                'contrast': 1.3,
-                'brightness': 1.15,
-                'sharpness': 1.4,
-                'saturation': 1.2,
-                'clahe_limit': 3.5,
-                'red_balance': 1.0,
-                'green_balance': 1.0,
-                'blue_balance': 1.0,
-                'denoise': 10,
-                'gamma': 1.0,
-                'edge_enhance': 1.0,
-                'detail_enhance': 1.0,
-                'bw_mode': False,
-                'auto_deskew': True,
-            }
-            # Clear cached settings
-            if os.path.exists('settings_cache.json'):
-                os.remove('settings_cache.json')
+            from settings_store import DEFAULT_SETTINGS
+            default_settings = dict(DEFAULT_SETTINGS)
+            # Clear the saved profile
+            get_settings_store().delete(get_user_id(), st.session_state.settings_profile)
 
             # Update session state
             st.session_state.user_settings = default_settings
@@ -379,16 +386,25 @@ def main():
         auto_crop = st.toggle("📐 Enable Auto-Crop",
                               value=True,
                               help="Automatically detect and crop documents")
+        split_multiple = st.toggle("🧾 Split Multiple Documents",
+                                   value=False,
+                                   help="Detect several slips in one photo and save each separately")
+        ocr_while_processing = st.toggle("📝 Extract Text While Processing",
+                                         value=True,
+                                         help="Run OCR alongside enhancement so text is ready when processing ends")
+        skip_ocr_with_symbols = st.toggle("🔳 Skip OCR When a QR/Barcode Is Found",
+                                          value=False,
+                                          help="Use the decoded QR code or barcode data instead of reading the text")
 
         st.markdown("---")
 
         # Image format selection
         image_format = st.selectbox("Select Output Format",
-                                    ["PNG", "JPEG", "PDF"],
+                                    ["PNG", "JPEG", "WEBP", "AVIF", "PDF"],
                                     index=0)
 
         # Quality settings based on format
-        if image_format in ["JPEG", "PDF"]:
+        if image_format in ["JPEG", "WEBP", "AVIF", "PDF"]:
             export_quality = st.slider(
                 "Quality",
                 min_value=1,
@@ -398,9 +414,36 @@ def main():
         else:
             export_quality = 95
 
+        # Compression for merged and searchable PDFs
+        pdf_compression = st.selectbox(
+            "PDF Compression",
+            ["Lossless", "Auto", "Bilevel", "Mixed Raster", "JPEG"],
+            index=0,
+            help="Auto uses black & white encoding for text pages and mixed raster for color pages")
+        pdf_compression = {"Lossless": "lossless", "Auto": "auto", "Bilevel": "bilevel",
+                           "Mixed Raster": "mrc", "JPEG": "jpeg"}[pdf_compression]
+        pdf_quality = st.select_slider("PDF Quality Target",
+                                       options=["low", "medium", "high"],
+                                       value="medium")
+
     # Advanced Settings Sidebar with tabs
     st.sidebar.title("⚙️ Advanced Settings")
 
+    # Named settings profiles for the current user
+    store = get_settings_store()
+    profiles = store.list_profiles(get_user_id())
+    if st.session_state.settings_profile not in profiles:
+        profiles.append(st.session_state.settings_profile)
+    selected_profile = st.sidebar.selectbox("Settings Profile",
+                                            profiles,
+                                            index=profiles.index(st.session_state.settings_profile))
+    if selected_profile != st.session_state.settings_profile:
+        load_settings(selected_profile)
+
+    new_profile = st.sidebar.text_input("New profile name", key="new_profile_name")
+    # Saved below, once the widgets hold the values to save
+    save_new_profile = st.sidebar.button("➕ Save as New Profile", use_container_width=True) and new_profile
+
     settings_tab1, settings_tab2 = st.sidebar.tabs(["Basic", "Advanced"])
 
     with settings_tab1:
@@ -410,26 +453,35 @@ def main():
         # Load settings from cache
         cached_settings = st.session_state.user_settings
 
+        # Contrast, brightness and sharpness are only applied by auto-tune
+        auto_tune = st.checkbox("Auto-Tune per Image",
+                                value=cached_settings.get('auto_tune', False),
+                                help="Analyze each image, skip enhancement steps it does not need "
+                                     "and apply the contrast, brightness and sharpness below")
+
         contrast = st.slider("Contrast", 
                            min_value=0.5, 
                            max_value=2.0, 
                            value=cached_settings['contrast'], 
                            step=0.1,
-                           help="Adjust image contrast")
+                           disabled=not auto_tune,
+                           help="Adjust image contrast (requires Auto-Tune)")
 
         brightness = st.slider("Brightness", 
                              min_value=0.5, 
                              max_value=2.0, 
                              value=cached_settings['brightness'], 
                              step=0.05,
-                             help="Adjust image brightness")
+                             disabled=not auto_tune,
+                             help="Adjust image brightness (requires Auto-Tune)")
 
         sharpness = st.slider("Sharpness", 
                              min_value=0.5, 
                              max_value=2.0, 
                              value=cached_settings['sharpness'], 
                              step=0.1,
-                             help="Adjust image sharpness")
+                             disabled=not auto_tune,
+                             help="Adjust image sharpness (requires Auto-Tune)")
 
         saturation = st.slider("Saturation", 
                              min_value=0.0, 
@@ -445,7 +497,8 @@ def main():
                 'contrast': contrast,
                 'brightness': brightness,
                 'sharpness': sharpness,
-                'saturation': saturation
+                'saturation': saturation,
+                'auto_tune': auto_tune
             })
             save_settings(settings)
 
@@ -466,48 +519,61 @@ def main():
         st.subheader("Color Balance")
         col1, col2, col3 = st.columns(3)
         with col1:
-            red_balance = st.slider("Red", 0.5, 1.5, 1.0, 0.1)
+            red_balance = st.slider("Red", 0.5, 1.5, float(settings.get('red_balance', 1.0)), 0.1)
         with col2:
-            green_balance = st.slider("Green", 0.5, 1.5, 1.0, 0.1)
+            green_balance = st.slider("Green", 0.5, 1.5, float(settings.get('green_balance', 1.0)), 0.1)
         with col3:
-            blue_balance = st.slider("Blue", 0.5, 1.5, 1.0, 0.1)
+            blue_balance = st.slider("Blue", 0.5, 1.5, float(settings.get('blue_balance', 1.0)), 0.1)
 
         # Additional processing options
         st.subheader("Additional Processing")
-        denoise = st.slider("Noise Reduction", 0, 20, 10, 1)
+        denoise = st.slider("Noise Reduction", 0, 20, int(settings.get('denoise', 10)), 1)
+        shadow_reduction = st.slider("Shadow Reduction", 0.0, 1.0,
+                                     float(settings.get('shadow_reduction', 0.25)), 0.05,
+                                     help="Even out uneven lighting and shadows across the page")
         gamma = st.slider("Gamma", 0.5, 2.0, 1.0, 0.1)
-        edge_enhance = st.slider("Edge Enhancement", 0.0, 2.0, 1.0, 0.1)
+        edge_enhance = st.slider("Edge Enhancement", 0.0, 2.0, float(settings.get('edge_enhance', 1.0)), 0.1)
         detail_enhance = st.slider("Detail Enhancement", 0.5, 2.0, 1.0, 0.1)
 
         # Processing modes
         st.subheader("Processing Modes")
-        bw_mode = st.checkbox("Black & White Mode")
+        bw_mode = st.checkbox("Black & White Mode",
+                              value=settings.get('bw_mode', False),
+                              help="Binarize pages with a faster single-channel pipeline")
         auto_deskew = st.checkbox("Auto-Deskew", value=True)
 
+        # The values currently shown in the widgets
+        current_settings = dict(settings)
+        current_settings.update({
+            'contrast': contrast,
+            'brightness': brightness,
+            'sharpness': sharpness,
+            'saturation': saturation,
+            'clahe_limit': settings['clahe_limit'],
+            'red_balance': red_balance,
+            'green_balance': green_balance,
+            'blue_balance': blue_balance,
+            'denoise': denoise,
+            'shadow_reduction': shadow_reduction,
+            'gamma': gamma,
+            'edge_enhance': edge_enhance,
+            'detail_enhance': detail_enhance,
+            'bw_mode': bw_mode,
+            'auto_deskew': auto_deskew,
+            'auto_tune': auto_tune
+        })
+
         # Single save button for all settings
         st.markdown("---")
         if st.button("💾 Save All Settings", use_container_width=True, key="save_all_settings"):
             settings = st.session_state.user_settings
-            settings.update({
-                'contrast': contrast,
-                'brightness': brightness,
-                'sharpness': sharpness,
-                'saturation': saturation,
-                'clahe_limit': settings['clahe_limit'],
-                'red_balance': red_balance,
-                'green_balance': green_balance,
-                'blue_balance': blue_balance,
-                'denoise': denoise,
-                'gamma': gamma,
-                'edge_enhance': edge_enhance,
-                'detail_enhance': detail_enhance,
-                'bw_mode': bw_mode,
-                'auto_deskew': auto_deskew
-            })
+            settings.update(current_settings)
             save_settings(settings)
-            # Force session state to persist
-            st.session_state.user_settings = settings
-            st.rerun()
+
+    if save_new_profile:
+        from settings_store import clean_profile_name
+        save_settings(current_settings, clean_profile_name(new_profile))
+        st.rerun()
 
     # Edge Detection Settings
     st.sidebar.subheader("Edge Detection")
@@ -529,9 +595,9 @@ def main():
     st.markdown("### 📤 Upload Documents")
     uploaded_files = st.file_uploader(
         "Drag and drop your files here",
-        type=['png', 'jpg', 'jpeg'],
+        type=['png', 'jpg', 'jpeg', 'pdf'] + [ext.lstrip('.') for ext in VIDEO_EXTENSIONS],
         accept_multiple_files=True,
-        help="Support for PNG, JPG, JPEG formats")
+        help="Support for PNG, JPG, JPEG and multi-page PDF files, or a short video to capture the steadiest frame")
 
     if uploaded_files:
         process_col1, process_col2, process_col3 = st.columns([1, 2, 1])
@@ -544,90 +610,212 @@ def main():
             st.session_state.processed_files = []
             st.session_state.processed_images = []
             st.session_state.processing_error = None
-
-            for idx, uploaded_file in enumerate(uploaded_files):
-                try:
-                    # Check file size
-                    if uploaded_file.size > 10 * 1024 * 1024:  # 10MB limit
-                        raise ValueError(
-                            f"File {uploaded_file.name} is too large. Maximum size is 10MB"
-                        )
-
-                    # Create custom settings based on user input
-                    custom_settings = ImageSettings()
-                    custom_settings.clahe_clip_limit = settings['clahe_limit']
-                    custom_settings.contrast = contrast
-                    custom_settings.brightness = brightness
-                    custom_settings.sharpness = sharpness
-                    custom_settings.canny_low = canny_low
-                    custom_settings.canny_high = canny_high
-
-                    # Load and process image with error handling
+            st.session_state.ocr_results = {}
+            st.session_state.symbol_results = {}
+
+            # Heavy modules are imported on first use (usually already warm)
+            from image_processor import preprocess_image, split_documents, ImageSettings
+            from capture import capture_from_upload
+            from export_handler import encode_image, IMAGE_MIME_TYPES
+            from pipeline import Pipeline, Stage
+            from admission import Cancelled, estimate_cost
+
+            # Create custom settings based on user input
+            custom_settings = ImageSettings()
+            custom_settings.clahe_clip_limit = settings['clahe_limit']
+            custom_settings.contrast = contrast
+            custom_settings.brightness = brightness
+            custom_settings.sharpness = sharpness
+            custom_settings.canny_low = canny_low
+            custom_settings.canny_high = canny_high
+            custom_settings.auto_tune = auto_tune
+            custom_settings.auto_rotate = auto_deskew
+            custom_settings.bw_mode = bw_mode
+            custom_settings.shadow_reduction = shadow_reduction
+            custom_settings.saturation = saturation
+            custom_settings.color_balance = {'red': red_balance, 'green': green_balance, 'blue': blue_balance}
+            custom_settings.noise_reduction = denoise > 0
+            custom_settings.denoise_strength = denoise
+            custom_settings.edge_enhancement = edge_enhance
+
+            # Reprocessing after a late-stage settings change reuses earlier stages
+            stage_caches = st.session_state.stage_caches
+
+            # Heavy stages wait for this session's turn at the shared CPU budget
+            admission = get_admission()
+            session_id = get_session_id()
+            cancelled = threading.Event()
+
+            def admitted(stage, size=None, parallelism=1):
+                # Queued jobs of an abandoned run give up instead of using the budget
+                return admission.admit(session_id, estimate_cost(stage, size, parallelism), cancelled=cancelled)
+
+            def fail(error):
+                """Job that reports an error found while reading the upload"""
+                def job():
+                    raise error
+                return job
+
+            def process_upload(uploaded_file):
+                """Split an upload into processing jobs, one per PDF page"""
+                # Check file size
+                if uploaded_file.size > 10 * 1024 * 1024:  # 10MB limit
+                    yield fail(ValueError(
+                        f"File {uploaded_file.name} is too large. Maximum size is 10MB"))
+                    return
+
+                base_name, extension = os.path.splitext(uploaded_file.name)
+                file_id = getattr(uploaded_file, 'file_id', uploaded_file.name)
+                if extension.lower() in VIDEO_EXTENSIONS:
+                    # Track the document through the video and capture the best frame
+                    def job():
+                        with admitted('video'):
+                            capture_result = capture_from_upload(uploaded_file, custom_settings)
+                        enhanced_versions = capture_result['enhanced_versions']
+                        return [(uploaded_file.name, enhanced_versions[1][1], enhanced_versions)]
+                    yield job
+                elif extension.lower() == '.pdf':
+                    def page_job(name, image, page):
+                        def job():
+                            with admitted('enhance', image.size):
+                                enhanced_versions = preprocess_image(
+                                    image, custom_settings, auto_crop=auto_crop,
+                                    cache=get_stage_cache(stage_caches, f"{file_id}:{page}"))
+                            return [(name, image, enhanced_versions)]
+                        return job
+
+                    # Pages are decoded one at a time as the pipeline asks for them
                     try:
-                        image = load_image(uploaded_file)
-                        if image.size[0] * image.size[
-                                1] > 25000000:  # Limit image dimensions
-                            image = image.resize((int(image.size[0] / 2),
-                                                  int(image.size[1] / 2)))
-                        enhanced_versions = preprocess_image(
-                            image, custom_settings)
+                        pages = enumerate(iter_pdf_pages(uploaded_file), start=1)
+                        while True:
+                            with admitted('pdf'):
+                                page = next(pages, None)
+                            if page is None:
+                                break
+                            page_number, page_image = page
+                            yield page_job(f"{base_name}_page_{page_number}{extension}", page_image, page_number)
                     except Exception as e:
-                        raise ValueError(
-                            f"Error processing {uploaded_file.name}: {str(e)}")
+                        yield fail(e)
+                else:
+                    def job():
+                        image = load_image(uploaded_file, custom_settings.max_dimension)
+                        with admitted('enhance', image.size):
+                            regions = split_documents(image, custom_settings) if split_multiple else []
+                            if len(regions) > 1:
+                                # Each detected slip becomes its own result
+                                return [
+                                    (f"{base_name}_{region_idx + 1}{extension}", image, [enhanced])
+                                    for region_idx, (_, _, enhanced) in enumerate(regions)
+                                ]
+                            enhanced_versions = preprocess_image(
+                                image, custom_settings, auto_crop=auto_crop,
+                                cache=get_stage_cache(stage_caches, file_id))
+                        return [(uploaded_file.name, image, enhanced_versions)]
+                    yield job
+
+            def jobs():
+                for idx, uploaded_file in enumerate(uploaded_files):
+                    for job in process_upload(uploaded_file):
+                        yield idx, uploaded_file.name, job
+
+            def enhance_stage(job):
+                idx, upload_name, run = job
+                try:
+                    return [
+                        {'name': document_name, 'original': image, 'enhanced_versions': enhanced_versions}
+                        for document_name, image, enhanced_versions in run()
+                    ]
+                except Exception as e:
+                    raise ValueError(f"Error processing {upload_name}: {str(e)}")
 
-                    # Store processed image data with memory management
-                    img_byte_arr = io.BytesIO()
+            def encode_stage(documents):
+                for document in documents:
                     try:
-                        if image_format == "PDF":
-                            enhanced_versions[0][1].save(
-                                img_byte_arr,
-                                format='PDF',
-                                resolution=300,
-                                quality=export_quality)
-                        else:
-                            enhanced_versions[0][1].save(
-                                img_byte_arr,
-                                format=image_format,
-                                quality=export_quality
-                                if image_format == "JPEG" else None)
+                        document['data'] = encode_image(
+                            document['enhanced_versions'][0][1], image_format, export_quality)
                     except Exception as e:
-                        raise ValueError(
-                            f"Error saving {uploaded_file.name}: {str(e)}")
-
-                    file_name = f"{os.path.splitext(uploaded_file.name)[0]}.{image_format.lower()}"
-                    mime_type = f"application/{image_format.lower()}" if image_format == "PDF" else f"image/{image_format.lower()}"
+                        document['error'] = f"Error saving {document['name']}: {str(e)}"
+                return documents
 
-                    # Store in session state
-                    st.session_state.processed_files.append({
-                        'name':
-                        file_name,
-                        'data':
-                        img_byte_arr.getvalue(),
-                        'mime':
-                        mime_type
-                    })
+            def ocr_stage(documents):
+                from ocr_handler import read_document, OCR_PARALLELISM
+                for document in documents:
+                    try:
+                        page = document['enhanced_versions'][0][1]
+                        with admitted('ocr', page.size, OCR_PARALLELISM):
+                            result = read_document(page, text_layer=True,
+                                                   skip_ocr_with_symbols=skip_ocr_with_symbols)
+                        # Failures are left for Tab3 to retry and report
+                        if result['error'] is None:
+                            document['ocr'] = (result['text'], result['text_layer'])
+                            document['symbols'] = result['symbols']
+                    except Cancelled:
+                        raise
+                    except Exception:
+                        pass
+                return documents
+
+            # Enhancement, encoding and OCR overlap; bounded queues keep at most a
+            # few pages in flight so large batches do not pile up in memory.
+            # OpenCV encoders release the GIL, so pages encode in parallel
+            stages = [Stage('enhance', enhance_stage),
+                      Stage('encode', encode_stage, workers=os.cpu_count() or 1)]
+            if ocr_while_processing:
+                stages.append(Stage('ocr', ocr_stage, workers=os.cpu_count() or 1))
+            pipeline = Pipeline(stages, queue_size=2)
+            queue_status = st.empty()
+
+            def idle():
+                show_queue_position(queue_status, *admission.position(session_id))
+
+            def results():
+                try:
+                    yield from pipeline.run(jobs(), idle=idle)
+                finally:
+                    # Also reached when a rerun interrupts the loop below
+                    cancelled.set()
+
+            for job, documents, error in results():
+                if error is not None:
+                    st.session_state.processing_error = str(error)
+                    st.error(f"Error: {str(error)}")
+                    if job is None:
+                        continue
+                    documents = []
+
+                for document in documents:
+                    enhanced_versions = document['enhanced_versions']
+                    if 'error' in document:
+                        st.session_state.processing_error = document['error']
+                        st.error(f"Error: {document['error']}")
+                    else:
+                        st.session_state.processed_files.append({
+                            'name': f"{os.path.splitext(document['name'])[0]}.{image_format.lower()}",
+                            'data': document['data'],
+                            'mime': IMAGE_MIME_TYPES[image_format]
+                        })
+                    if 'ocr' in document:
+                        st.session_state.ocr_results[document['name']] = document['ocr']
+                        st.session_state.symbol_results[document['name']] = document['symbols']
 
                     st.session_state.processed_images.append({
                         'name':
-                        uploaded_file.name,
+                        document['name'],
                         'original':
-                        image,
+                        document['original'],
                         'processed':
                         enhanced_versions[0][1],
                         'type':
                         enhanced_versions[0][0]
                     })
 
-                    # Update progress
-                    progress = (idx + 1) / len(uploaded_files)
-                    if 'progress_placeholder' not in st.session_state:
-                        st.session_state.progress_placeholder = st.progress(0.0)
-                    st.session_state.progress_placeholder.progress(progress)
+                # Update progress
+                progress = (job[0] + 1) / len(uploaded_files)
+                if 'progress_placeholder' not in st.session_state:
+                    st.session_state.progress_placeholder = st.progress(0.0)
+                st.session_state.progress_placeholder.progress(progress)
 
-                except Exception as e:
-                    st.session_state.processing_error = str(e)
-                    st.error(f"Error: {str(e)}")
-                    continue
+            queue_status.empty()
 
             # Complete progress bar
             if 'progress_placeholder' in st.session_state:
@@ -680,7 +868,10 @@ def main():
                                         # Create PDF with image
                                         try:
                                             from export_handler import export_to_pdf
-                                            pdf_data = export_to_pdf("", img_data['processed'])
+                                            # Encode the PDF once, not on every rerun
+                                            if 'pdf' not in img_data:
+                                                img_data['pdf'] = export_to_pdf("", img_data['processed'])
+                                            pdf_data = img_data['pdf']
                                             st.download_button(
                                                 label="📥 PDF (Recommended)",
                                                 data=pdf_data,
@@ -735,7 +926,8 @@ def main():
                         try:
                             from export_handler import merge_images_to_pdf
                             processed_images = [img_data['processed'] for img_data in st.session_state.processed_images]
-                            merged_pdf = merge_images_to_pdf(processed_images)
+                            with admitted_in_script('export'):
+                                merged_pdf = merge_images_to_pdf(processed_images, pdf_compression, pdf_quality, bw_mode)
                             st.download_button(
                                 label="📥 Download Merged PDF",
                                 data=merged_pdf,
@@ -790,9 +982,28 @@ def main():
                     for img_data in st.session_state.processed_images:
                         with st.expander(f"📄 Text from {img_data['name']}", expanded=True):
                             try:
-                                from ocr_handler import extract_text
-                                from export_handler import export_to_excel
-                                text = extract_text(img_data['processed'])
+                                from ocr_handler import read_document
+                                from export_handler import export_to_excel, export_to_searchable_pdf
+                                # OCR each page once; the text layer is reused for searchable PDFs
+                                if img_data['name'] not in st.session_state.ocr_results:
+                                    from ocr_handler import OCR_PARALLELISM
+                                    with admitted_in_script('ocr', img_data['processed'].size, OCR_PARALLELISM):
+                                        result = read_document(img_data['processed'], text_layer=True,
+                                                               skip_ocr_with_symbols=skip_ocr_with_symbols)
+                                    text, text_layer = result['text'], result['text_layer']
+                                    st.session_state.symbol_results[img_data['name']] = result['symbols']
+                                    # A failed run is shown but tried again on the next rerun
+                                    if result['error'] is None:
+                                        st.session_state.ocr_results[img_data['name']] = (text, text_layer)
+                                    else:
+                                        st.error(f"❌ OCR Error: {result['error']}")
+                                else:
+                                    text, text_layer = st.session_state.ocr_results[img_data['name']]
+
+                                # Structured data from QR codes and barcodes on the page
+                                for symbol in st.session_state.symbol_results.get(img_data['name'], []):
+                                    st.markdown(f"**{symbol['type'].replace('_', ' ')}**")
+                                    st.code(symbol['data'], language=None)
                                 search_term = st.text_input("Search in text:", key=f"search_{img_data['name']}")
                                 if search_term:
                                     import re
@@ -801,7 +1012,7 @@ def main():
                                 else:
                                     st.text_area("Extracted Text:", value=text, height=200)
 
-                                col1, col2 = st.columns(2)
+                                col1, col2, col3 = st.columns(3)
                                 # Add copy button
                                 with col1:
                                     if st.button(f"📋 Copy Text", key=f"copy_{img_data['name']}"):
@@ -818,8 +1029,84 @@ def main():
                                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                                         key=f"excel_{img_data['name']}"
                                     )
+
+                                # Add searchable PDF button
+                                with col3:
+                                    if text_layer:
+                                        # Encoding is slow; build on request and keep the bytes until the options change
+                                        pdf_options = (pdf_compression, pdf_quality, bw_mode)
+                                        cached_pdf = img_data.get('searchable_pdf')
+                                        if cached_pdf is None or cached_pdf[0] != pdf_options:
+                                            cached_pdf = None
+                                            if st.button("📑 Build Searchable PDF", key=f"build_searchable_pdf_{img_data['name']}"):
+                                                with admitted_in_script('export', img_data['processed'].size):
+                                                    searchable_pdf = export_to_searchable_pdf(
+                                                        [(img_data['processed'], text_layer)], compression=pdf_compression,
+                                                        quality=pdf_quality, bw_mode=bw_mode)
+                                                cached_pdf = img_data['searchable_pdf'] = (pdf_options, searchable_pdf)
+                                        if cached_pdf is not None:
+                                            st.download_button(
+                                                label="📥 Searchable PDF",
+                                                data=cached_pdf[1],
+                                                file_name=f"{os.path.splitext(img_data['name'])[0]}_searchable.pdf",
+                                                mime="application/pdf",
+                                                key=f"searchable_pdf_{img_data['name']}"
+                                            )
                             except Exception as e:
                                 st.error(f"Could not extract text: {str(e)}")
+
+                    # Export every document's text to one workbook
+                    if len(st.session_state.processed_images) > 1:
+                        excel_layout = st.radio("Batch Excel layout",
+                                                ["One sheet per document", "Single table"],
+                                                horizontal=True,
+                                                key="batch_excel_layout")
+                        from export_handler import export_batch_to_excel
+                        batch_documents = [
+                            (img_data['name'], st.session_state.ocr_results[img_data['name']][0])
+                            for img_data in st.session_state.processed_images
+                            if img_data['name'] in st.session_state.ocr_results
+                        ]
+                        st.download_button(
+                            label="📥 Export All to Excel",
+                            data=export_batch_to_excel(batch_documents,
+                                                       consolidated=excel_layout == "Single table"),
+                            file_name=f"extracted_text_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                            key="batch_excel"
+                        )
+
+                    # Merge every page with its OCR text layer
+                    if len(st.session_state.processed_images) > 1:
+                        # Same documents, OCR results and options as the last merge reuse its bytes
+                        merge_options = (pdf_compression, pdf_quality, bw_mode,
+                                         tuple(name for name in st.session_state.ocr_results))
+                        merged_pdf = st.session_state.get('merged_searchable_pdf')
+                        if merged_pdf is None or merged_pdf[0] is not st.session_state.processed_images \
+                                or merged_pdf[1] != merge_options:
+                            merged_pdf = None
+                        if st.button("📑 Merge All to Searchable PDF", key="merge_searchable_pdf"):
+                            try:
+                                from export_handler import export_to_searchable_pdf
+                                pages = (
+                                    (img_data['processed'], st.session_state.ocr_results.get(img_data['name'], (None, None))[1])
+                                    for img_data in st.session_state.processed_images
+                                )
+                                with admitted_in_script('export'):
+                                    searchable_pdf = export_to_searchable_pdf(pages, compression=pdf_compression,
+                                                                              quality=pdf_quality, bw_mode=bw_mode)
+                                merged_pdf = (st.session_state.processed_images, merge_options, searchable_pdf)
+                                st.session_state.merged_searchable_pdf = merged_pdf
+                            except Exception as e:
+                                st.error(f"❌ Error creating searchable PDF: {str(e)}")
+                        if merged_pdf is not None:
+                            st.download_button(
+                                label="📥 Download Searchable PDF",
+                                data=merged_pdf[2],
+                                file_name=f"searchable_documents_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                                mime="application/pdf",
+                                key="download_searchable_pdf"
+                            )
                     # Add prominent download all button
                     st.markdown("""
                         <div style='background-color: #f0f2f6; padding: 20px; border-radius: 10px; margin-bottom: 20px;'>
@@ -944,6 +1231,9 @@ def main():
     """,
                 unsafe_allow_html=True)
 
+    # The page is painted; import the processing stack in the background
+    prewarm()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
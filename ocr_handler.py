@@ -1,10 +1,31 @@
+import os
+import shlex
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
 import pytesseract
 import numpy as np
 import cv2
 from PIL import Image
 
-# Set Tesseract executable path for Replit environment
-pytesseract.pytesseract.tesseract_cmd = '/nix/store/rvl3l4hy1k12vwvvzh0n9l2lz6pww92h-tesseract-5.3.3/bin/tesseract'
+from resources import get_clahe, get_resource, get_thread_resource
+
+# Threads in each OCR pool (regions, then re-recognized lines). A region waiting
+# on its lines is idle, so one page keeps about this many Tesseract processes
+# busy; admission control charges OCR for this fan-out
+OCR_PARALLELISM = os.cpu_count() or 1
+
+# Tesseract executable path for Replit environment
+TESSERACT_CMD = '/nix/store/rvl3l4hy1k12vwvvzh0n9l2lz6pww92h-tesseract-5.3.3/bin/tesseract'
+
+def _configure_tesseract():
+    """Point pytesseract at the Tesseract binary, falling back to the one on PATH"""
+    cmd = TESSERACT_CMD if os.path.exists(TESSERACT_CMD) else shutil.which('tesseract') or TESSERACT_CMD
+    pytesseract.pytesseract.tesseract_cmd = cmd
+    # Regions are recognized in parallel, so each Tesseract process stays single-threaded
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    return cmd
 
 def preprocess_for_ocr(image):
     """Preprocess image for better OCR results"""
@@ -24,65 +45,349 @@ def preprocess_for_ocr(image):
 
     return gray
 
+def _run_tesseract(image, config, extensions):
+    """Run Tesseract once and collect several output formats from the same recognition"""
+    with tempfile.TemporaryDirectory(prefix='tess_') as temp_dir:
+        input_path = os.path.join(temp_dir, 'input.png')
+        output_base = os.path.join(temp_dir, 'output')
+        cv2.imwrite(input_path, image)
+
+        pytesseract.pytesseract.run_tesseract(
+            input_path, output_base, ' '.join(extensions), 'eng', config
+        )
+
+        outputs = {}
+        for extension in extensions:
+            with open(f"{output_base}.{extension}", 'rb') as f:
+                outputs[extension] = f.read()
+        return outputs
+
+def _qr_detector():
+    # The ArUco-based detector (OpenCV 4.8+) finds small and damaged codes more reliably
+    factory = getattr(cv2, 'QRCodeDetectorAruco', cv2.QRCodeDetector)
+    return get_thread_resource('qr_detector', factory)
+
+def _retry_full_resolution(decode, gray, quad, margin=0.15):
+    """Decode a symbol that was found but not read on the small copy, from the full-resolution crop"""
+    x, y, w, h = cv2.boundingRect(np.asarray(quad, dtype=np.float32))
+    pad_x, pad_y = int(w * margin) + 4, int(h * margin) + 4
+    crop = gray[max(0, y - pad_y):y + h + pad_y, max(0, x - pad_x):x + w + pad_x]
+    return decode(crop) if crop.size else ''
+
+def decode_symbols(image, analysis_dimension=1000):
+    """Decode QR codes and barcodes, detecting on a downscaled copy of the page
+
+    Returns a list of {'type', 'data', 'points'} with points in source pixels.
+    """
+    if isinstance(image, Image.Image):
+        image = np.asarray(image)
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+
+    height, width = gray.shape[:2]
+    scale = min(1.0, analysis_dimension / max(height, width))
+    small = cv2.resize(gray, (int(width * scale), int(height * scale)),
+                       interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+    symbols = []
+    qr = _qr_detector()
+    found, texts, points, _ = qr.detectAndDecodeMulti(small)
+    if found:
+        for text, quad in zip(texts, points):
+            quad = quad / scale
+            if not text and scale < 1.0:
+                text = _retry_full_resolution(lambda crop: qr.detectAndDecode(crop)[0], gray, quad)
+            if text:
+                symbols.append({'type': 'QR_CODE', 'data': text, 'points': quad.tolist()})
+
+    if hasattr(cv2, 'barcode'):
+        barcode = get_thread_resource('barcode_detector', cv2.barcode.BarcodeDetector)
+        found, texts, types, points = barcode.detectAndDecodeWithType(small)
+        if found:
+            for text, symbol_type, quad in zip(texts, types, points):
+                quad = quad / scale
+                if not text and scale < 1.0:
+                    text = _retry_full_resolution(lambda crop: barcode.detectAndDecode(crop)[0], gray, quad)
+                if text:
+                    symbols.append({'type': symbol_type or 'BARCODE', 'data': text, 'points': quad.tolist()})
+    return symbols
+
+def detect_text_regions(gray, analysis_dimension=1000, padding=12):
+    """Find text blocks in a greyscale page, returned as (x, y, w, h) boxes in reading order"""
+    height, width = gray.shape[:2]
+    scale = min(1.0, analysis_dimension / max(height, width))
+    small = cv2.resize(gray, (int(width * scale), int(height * scale)),
+                       interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+    # Strokes have strong local gradients; flat paper, margins and smooth backgrounds do not
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT,
+                                cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    # Join characters into words and lines, then lines into blocks
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 1)))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (1, 9)))
+
+    # Ink as the page's own threshold sees it; the gradient mask only has the
+    # outline of a filled shape, so density is measured here instead
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    boxes = []
+    for x, y, w, h, area in stats[1:]:
+        # Drop specks, and solid blobs (logos, photos) that are too tall and
+        # square for a text line and mostly ink, where text leaves paper between strokes
+        speck = h < 6 or w < 8
+        solid_blob = (h > 60) and (w < 3 * h) and \
+            cv2.countNonZero(ink[y:y + h, x:x + w]) > 0.5 * w * h
+        if speck or solid_blob:
+            continue
+        pad = padding * scale
+        x0, y0 = max(0, int((x - pad) / scale)), max(0, int((y - pad) / scale))
+        x1, y1 = min(width, int((x + w + pad) / scale)), min(height, int((y + h + pad) / scale))
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+
+    if not boxes:
+        return []
+
+    # Lines closer than a line height belong to one block; fewer, larger crops
+    # keep the number of Tesseract runs down
+    line_gap = int(0.75 * np.median([h for _, _, _, h in boxes]))
+    return _reading_order(_merge_boxes(boxes, line_gap))
+
+def _merge_boxes(boxes, gap=0):
+    """Merge boxes that overlap or are vertically closer than gap until none do"""
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            x, y, w, h = box
+            for index, (ox, oy, ow, oh) in enumerate(result):
+                if x < ox + ow and ox < x + w and y - gap < oy + oh and oy - gap < y + h:
+                    nx, ny = min(x, ox), min(y, oy)
+                    result[index] = (nx, ny, max(x + w, ox + ow) - nx, max(y + h, oy + oh) - ny)
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+def _reading_order(boxes):
+    """Top-to-bottom rows of boxes, each row left-to-right"""
+    rows = []
+    for box in sorted(boxes, key=lambda box: box[1]):
+        center = box[1] + box[3] / 2
+        if rows and center < rows[-1][0]:
+            rows[-1][1].append(box)
+            rows[-1][0] = max(rows[-1][0], box[1] + box[3])
+        else:
+            rows.append([box[1] + box[3], [box]])
+    return [box for _, row in rows for box in sorted(row)]
+
+def _prepare_for_ocr(gray):
+    """Binarize, clean and upscale a greyscale image for Tesseract"""
+    # Enhance contrast using CLAHE
+    clahe = get_clahe(2.0, (8,8))
+    gray = clahe.apply(gray)
+
+    # Apply adaptive thresholding
+    binary = cv2.adaptiveThreshold(
+        gray, 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, 11, 2
+    )
+
+    # Remove noise
+    denoised = cv2.fastNlMeansDenoising(binary)
+
+    # Scale up image for better OCR
+    scaled = cv2.resize(denoised, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    return scaled
+
+# Lines whose mean word confidence falls below this are recognized again
+LINE_CONFIDENCE_THRESHOLD = 75
+
+# Upper bound on re-recognized lines per image, lowest confidence first
+MAX_LINE_RETRIES = 24
+
+OCR_WHITELIST = r'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,!@#$%^&*()_+-=[]{}|;:"<>?/~'
+
+# (scale, config) alternatives tried on a low-confidence line crop
+LINE_VARIANTS = [
+    (1.0, '--oem 3 --psm 7'),  # Single text line
+    # Quoted because pytesseract splits the config like a shell command
+    (1.0, f'--oem 3 --psm 7 -c tessedit_char_whitelist={shlex.quote(OCR_WHITELIST)}'),
+    (1.5, '--oem 3 --psm 7'),
+    (1.0, '--oem 3 --psm 13'),  # Raw line, no layout analysis
+]
+
+def _tsv_lines(tsv):
+    """Group Tesseract TSV words into lines: (block, paragraph) key, box, words and confidences"""
+    lines = {}
+    for row in tsv.decode('utf-8', errors='replace').splitlines()[1:]:
+        fields = row.split('\t')
+        if len(fields) < 12 or fields[0] != '5' or not fields[11].strip():
+            continue
+        block, paragraph, line = int(fields[2]), int(fields[3]), int(fields[4])
+        left, top, width, height = (int(value) for value in fields[6:10])
+        entry = lines.setdefault((block, paragraph, line), {
+            'paragraph': (block, paragraph), 'box': [left, top, left + width, top + height],
+            'words': [], 'confidences': []
+        })
+        box = entry['box']
+        box[0], box[1] = min(box[0], left), min(box[1], top)
+        box[2], box[3] = max(box[2], left + width), max(box[3], top + height)
+        entry['words'].append(fields[11])
+        entry['confidences'].append(max(float(fields[10]), 0.0))
+    return list(lines.values())
+
+def _line_confidence(line):
+    return sum(line['confidences']) / len(line['confidences'])
+
+def _recognize_line(scaled, line):
+    """Best (text, confidence) for one line crop across LINE_VARIANTS"""
+    x0, y0, x1, y1 = line['box']
+    pad = max(4, (y1 - y0) // 4)
+    crop = scaled[max(0, y0 - pad):y1 + pad, max(0, x0 - pad):x1 + pad]
+
+    best = (' '.join(line['words']), _line_confidence(line))
+    for scale, config in LINE_VARIANTS:
+        variant = crop if scale == 1.0 else cv2.resize(crop, None, fx=scale, fy=scale,
+                                                       interpolation=cv2.INTER_CUBIC)
+        try:
+            tsv = _run_tesseract(variant, f"-c tessedit_create_tsv=1 {config}", ['tsv'])['tsv']
+        except Exception as e:
+            print(f"OCR error with line config {config}: {str(e)}")
+            continue
+        words = [word for candidate in _tsv_lines(tsv) for word in zip(candidate['words'], candidate['confidences'])]
+        if words:
+            confidence = sum(conf for _, conf in words) / len(words)
+            if confidence > best[1]:
+                best = (' '.join(word for word, _ in words), confidence)
+    return best
+
+def _recognize(scaled, text_layer=False, psm=3):
+    """One layout-aware pass with per-line confidences, then re-recognize only the weak lines"""
+    config = f"-c tessedit_create_tsv=1 --oem 3 --psm {psm}"
+    if text_layer:
+        # The text-only PDF comes from the same recognition run
+        outputs = _run_tesseract(scaled, f"{config} -c textonly_pdf=1", ['tsv', 'pdf'])
+    else:
+        outputs = _run_tesseract(scaled, config, ['tsv'])
+    lines = _tsv_lines(outputs['tsv'])
+
+    if not lines:
+        # Nothing found with layout analysis; try sparse text once
+        lines = _tsv_lines(_run_tesseract(scaled, "-c tessedit_create_tsv=1 --oem 3 --psm 11", ['tsv'])['tsv'])
+
+    texts = [' '.join(line['words']) for line in lines]
+    weak = sorted(
+        (index for index, line in enumerate(lines) if _line_confidence(line) < LINE_CONFIDENCE_THRESHOLD),
+        key=lambda index: _line_confidence(lines[index])
+    )[:MAX_LINE_RETRIES]
+    if weak:
+        # Line crops are small, so variants cost a fraction of another full-page pass
+        executor = get_resource('ocr_line_executor', lambda: ThreadPoolExecutor(max_workers=OCR_PARALLELISM))
+        for index, (text, _) in zip(weak, executor.map(lambda index: _recognize_line(scaled, lines[index]), weak)):
+            texts[index] = text
+
+    # Lines of a paragraph on consecutive rows, paragraphs separated by a blank line
+    text = ''
+    for index, line in enumerate(lines):
+        if index:
+            text += '\n\n' if line['paragraph'] != lines[index - 1]['paragraph'] else '\n'
+        text += texts[index]
+    return text, outputs.get('pdf')
+
+def _compose_text_layer(page_size, layers):
+    """Place each region's text-only PDF at its position on one page the size of the image"""
+    import pymupdf
+    with pymupdf.open() as pdf:
+        page = pdf.new_page(width=page_size[0], height=page_size[1])
+        for (x, y, w, h), layer in layers:
+            if layer:
+                with pymupdf.open(stream=layer, filetype="pdf") as region:
+                    page.show_pdf_page(pymupdf.Rect(x, y, x + w, y + h), region, 0, keep_proportion=False)
+        return pdf.tobytes()
+
+def _extract(image, text_layer=False):
+    """OCR the text regions of a page in parallel and return the text, plus its PDF text layer if requested"""
+    get_resource('tesseract_cmd', _configure_tesseract)
+
+    # Convert to numpy array if PIL Image
+    if isinstance(image, Image.Image):
+        image = np.array(image)
+
+    # Convert to grayscale
+    if len(image.shape) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    else:
+        gray = image
+
+    # Only text blocks are cleaned and recognized; fall back to the whole page
+    # when nothing is found or the text fills most of it anyway
+    regions = detect_text_regions(gray)
+    height, width = gray.shape[:2]
+    if not regions or sum(w * h for _, _, w, h in regions) > 0.85 * width * height:
+        return _recognize(_prepare_for_ocr(gray), text_layer, psm=3)
+
+    executor = get_resource('ocr_executor', lambda: ThreadPoolExecutor(max_workers=OCR_PARALLELISM))
+    results = list(executor.map(
+        # Each region is one block of text
+        lambda box: _recognize(_prepare_for_ocr(gray[box[1]:box[1] + box[3], box[0]:box[0] + box[2]]),
+                               text_layer, psm=6),
+        regions
+    ))
+
+    text = '\n\n'.join(text.strip() for text, _ in results if text and text.strip())
+    if not text_layer:
+        return text, None
+    return text, _compose_text_layer((width, height), [
+        (box, layer) for box, (_, layer) in zip(regions, results)
+    ])
+
+# Shown in place of the text when OCR fails
+OCR_ERROR_TEXT = "Error: Could not extract text. Please try again with a clearer image."
+
 def extract_text(image):
     """Extract text from an image using Tesseract OCR"""
     try:
-        # Convert to numpy array if PIL Image
-        if isinstance(image, Image.Image):
-            image = np.array(image)
+        return _extract(image)[0]
 
-        # Convert to grayscale
-        if len(image.shape) == 3:
-            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        else:
-            gray = image
+    except Exception as e:
+        print(f"OCR Error details: {str(e)}")
+        return OCR_ERROR_TEXT
+
+def extract_text_with_layer(image):
+    """Extract text and an invisible PDF text layer for the page from the same OCR run"""
+    try:
+        return _extract(image, text_layer=True)
 
-        # Enhance contrast using CLAHE
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        gray = clahe.apply(gray)
+    except Exception as e:
+        print(f"OCR Error details: {str(e)}")
+        return OCR_ERROR_TEXT, None
 
-        # Apply adaptive thresholding
-        binary = cv2.adaptiveThreshold(
-            gray, 255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY, 11, 2
-        )
+def read_document(image, text_layer=False, skip_ocr_with_symbols=False):
+    """Decode QR codes and barcodes, then OCR the page unless a symbol made it unnecessary
 
-        # Remove noise
-        denoised = cv2.fastNlMeansDenoising(binary)
-
-        # Scale up image for better OCR
-        scaled = cv2.resize(denoised, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
-
-        # Configure tesseract for better accuracy
-        custom_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789.,!@#$%^&*()_+-=[]{}|;:"<>?/~ '
-
-        # Try OCR with different settings
-        configs = [
-            custom_config,
-            '--oem 3 --psm 1',  # Automatic page segmentation
-            '--oem 3 --psm 3',  # Fully automatic page segmentation
-            '--oem 3 --psm 4',  # Assume single column of text
-            '--oem 3 --psm 6'   # Assume uniform block of text
-        ]
-
-        results = []
-        for config in configs:
-            try:
-                text = pytesseract.image_to_string(scaled, config=config, lang='eng')
-                if text and text.strip():
-                    results.append(text.strip())
-            except Exception as e:
-                print(f"OCR error with config {config}: {str(e)}")
-                continue
-
-        if results:
-            # Use the result with the most alphanumeric characters
-            best_result = max(results, key=lambda x: sum(c.isalnum() for c in x))
-            return best_result
-
-        return pytesseract.image_to_string(scaled)  # Try one last time with default settings
+    Returns {'text', 'text_layer', 'symbols', 'error'}. With skip_ocr_with_symbols
+    the decoded payloads stand in for the OCR text whenever any symbol was read.
+    When OCR fails, text is OCR_ERROR_TEXT and error holds the reason.
+    """
+    try:
+        symbols = decode_symbols(image)
+    except Exception as e:
+        print(f"Symbol decoding error: {str(e)}")
+        symbols = []
 
+    if symbols and skip_ocr_with_symbols:
+        text = '\n'.join(f"{symbol['type']}: {symbol['data']}" for symbol in symbols)
+        return {'text': text, 'text_layer': None, 'symbols': symbols, 'error': None}
+
+    try:
+        text, layer = _extract(image, text_layer=text_layer)
     except Exception as e:
         print(f"OCR Error details: {str(e)}")
-        return "Error: Could not extract text. Please try again with a clearer image."
\ No newline at end of file
+        return {'text': OCR_ERROR_TEXT, 'text_layer': None, 'symbols': symbols, 'error': str(e)}
+    return {'text': text, 'text_layer': layer, 'symbols': symbols, 'error': None}
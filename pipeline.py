@@ -0,0 +1,147 @@
+import queue
+import threading
+
+# Marks the end of the stream on a stage queue
+_END = object()
+
+class Stage:
+    """One pipeline step: a function applied by a fixed number of worker threads"""
+
+    def __init__(self, name, function, workers=1):
+        self.name = name
+        self.function = function
+        self.workers = workers
+
+class Pipeline:
+    """Overlap stages (e.g. OpenCV enhancement and Tesseract OCR) with bounded queues between them
+
+    Items flow through every stage as soon as the previous stage finishes with
+    them. Each queue holds at most queue_size items, so a slow stage blocks the
+    ones before it instead of letting finished work pile up in memory. Items
+    waiting to be reordered count too: at most max_in_flight items are taken
+    from the input before the oldest one has been yielded.
+    """
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    @property
+    def max_in_flight(self):
+        return self.queue_size + sum(stage.workers for stage in self.stages)
+
+    def run(self, items, idle=None, idle_interval=0.5):
+        """Yield (item, result, error) in input order while later items are still in flight
+
+        idle() is called on the consuming thread every idle_interval seconds
+        while no result is ready, e.g. to refresh a status message.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        # Taken by the feeder per item and given back when the item is yielded, so
+        # one slow item cannot let the rest of the input pile up behind it
+        in_flight = threading.Semaphore(self.max_in_flight)
+        threads = []
+
+        def put(target, entry):
+            # Give up waiting once the consumer has gone away
+            while not stop.is_set():
+                try:
+                    target.put(entry, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(source):
+            while not stop.is_set():
+                try:
+                    return source.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _END
+
+        def acquire():
+            while not stop.is_set():
+                if in_flight.acquire(timeout=0.1):
+                    return True
+            return False
+
+        def feed():
+            try:
+                iterator = iter(items)
+                index = 0
+                # Wait for room before pulling the next item, which may decode a page
+                while acquire():
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    if not put(queues[0], (index, item, item, None)):
+                        return
+                    index += 1
+            except Exception as e:
+                put(queues[0], (-1, None, None, e))
+            finally:
+                put(queues[0], _END)
+
+        def work(stage, source, target, finished, lock):
+            while True:
+                entry = get(source)
+                if entry is _END:
+                    # Let sibling workers see the end too; the last one forwards it
+                    put(source, entry)
+                    with lock:
+                        finished[0] += 1
+                        last = finished[0] == stage.workers
+                    if last:
+                        put(target, _END)
+                    return
+                index, item, value, error = entry
+                if error is None:
+                    try:
+                        value = stage.function(value)
+                    except Exception as e:
+                        error = e
+                if not put(target, (index, item, value, error)):
+                    return
+
+        threads.append(threading.Thread(target=feed, name='pipeline-feed', daemon=True))
+        for stage_index, stage in enumerate(self.stages):
+            finished, lock = [0], threading.Lock()
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=work,
+                    args=(stage, queues[stage_index], queues[stage_index + 1], finished, lock),
+                    name=f"pipeline-{stage.name}-{worker}",
+                    daemon=True
+                ))
+        for thread in threads:
+            thread.start()
+
+        # Reorder completed items so results come out in input order
+        output, pending, next_index = queues[-1], {}, 0
+        try:
+            while True:
+                try:
+                    entry = output.get(timeout=idle_interval if idle else None)
+                except queue.Empty:
+                    idle()
+                    continue
+                if entry is _END:
+                    break
+                index, item, value, error = entry
+                if index < 0:
+                    # The input iterator itself failed
+                    yield None, None, error
+                    continue
+                pending[index] = (item, value, error)
+                while next_index in pending:
+                    result = pending.pop(next_index)
+                    in_flight.release()
+                    next_index += 1
+                    yield result
+            for index in sorted(pending):
+                yield pending[index]
+        finally:
+            stop.set()
@@ -0,0 +1,65 @@
+import importlib
+import threading
+
+# Process-wide cache of expensive singletons, shared by every Streamlit session
+_registry = {}
+_registry_lock = threading.Lock()
+_thread_local = threading.local()
+
+# Modules worth importing before the first document is processed
+HEAVY_MODULES = (
+    'numpy',
+    'cv2',
+    'PIL.Image',
+    'image_processor',
+    'capture',
+    'export_handler',
+    'ocr_handler',
+    'pymupdf',
+)
+
+def get_resource(key, factory):
+    """Return the shared object for key, creating it once per process"""
+    try:
+        return _registry[key]
+    except KeyError:
+        pass
+
+    with _registry_lock:
+        if key not in _registry:
+            _registry[key] = factory()
+        return _registry[key]
+
+def get_thread_resource(key, factory):
+    """Like get_resource, but one instance per thread for objects that are not thread-safe"""
+    cache = getattr(_thread_local, 'cache', None)
+    if cache is None:
+        cache = _thread_local.cache = {}
+    if key not in cache:
+        cache[key] = factory()
+    return cache[key]
+
+def get_clahe(clip_limit, tile_grid_size=(8, 8)):
+    """Cached CLAHE object (CLAHE keeps internal buffers, so one per thread)"""
+    import cv2
+    tile_grid_size = tuple(tile_grid_size)
+    return get_thread_resource(
+        ('clahe', clip_limit, tile_grid_size),
+        lambda: cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+    )
+
+def _warm_imports(modules):
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"Warm-up import of {name} failed: {e}")
+
+def prewarm(modules=HEAVY_MODULES):
+    """Import heavy modules on a background thread, once per process"""
+    def start():
+        thread = threading.Thread(target=_warm_imports, args=(modules,), name='prewarm', daemon=True)
+        thread.start()
+        return thread
+
+    return get_resource(('prewarm', tuple(modules)), start)
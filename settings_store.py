@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+
+DEFAULT_SETTINGS = {
+    'contrast': 1.3,
+    'brightness': 1.15,
+    'sharpness': 1.4,
+    'saturation': 1.2,
+    'clahe_limit': 3.5,
+    'red_balance': 1.0,
+    'green_balance': 1.0,
+    'blue_balance': 1.0,
+    'denoise': 10,
+    'shadow_reduction': 0.25,
+    'gamma': 1.0,
+    'edge_enhance': 1.0,
+    'detail_enhance': 1.0,
+    'bw_mode': False,
+    'auto_deskew': True,
+    'auto_tune': False,
+}
+
+DEFAULT_PROFILE = 'default'
+
+def clean_profile_name(name):
+    """Profile names are limited to letters, digits, spaces, dashes and underscores"""
+    cleaned = re.sub(r'[^A-Za-z0-9 _-]', '', name or '').strip()[:40]
+    return cleaned or DEFAULT_PROFILE
+
+class SettingsBackend:
+    """Persistent storage for per-user settings profiles"""
+
+    def load(self, user_id, profile):
+        raise NotImplementedError
+
+    def save(self, user_id, profile, settings):
+        raise NotImplementedError
+
+    def delete(self, user_id, profile):
+        raise NotImplementedError
+
+    def list_profiles(self, user_id):
+        raise NotImplementedError
+
+class LocalFileBackend(SettingsBackend):
+    """One JSON file per profile under a per-user directory"""
+
+    def __init__(self, directory='settings_profiles'):
+        self.directory = directory
+
+    def _user_dir(self, user_id):
+        # Hash the user id so e-mail addresses never end up in paths
+        digest = hashlib.sha256(user_id.encode()).hexdigest()[:24]
+        return os.path.join(self.directory, digest)
+
+    def _path(self, user_id, profile):
+        return os.path.join(self._user_dir(user_id), f"{profile}.json")
+
+    def load(self, user_id, profile):
+        path = self._path(user_id, profile)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save(self, user_id, profile, settings):
+        user_dir = self._user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+
+        # Write a temporary file and rename it over the old one, so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=user_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(settings, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self._path(user_id, profile))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def delete(self, user_id, profile):
+        path = self._path(user_id, profile)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def list_profiles(self, user_id):
+        user_dir = self._user_dir(user_id)
+        if not os.path.isdir(user_dir):
+            return []
+        return sorted(name[:-5] for name in os.listdir(user_dir) if name.endswith('.json'))
+
+class ReplitObjectStorageBackend(SettingsBackend):
+    """Profiles stored as JSON objects in Replit Object Storage"""
+
+    def __init__(self, prefix='settings_profiles'):
+        from replit.object_storage import Client
+        self.client = Client()
+        self.prefix = prefix
+
+    def _key(self, user_id, profile):
+        digest = hashlib.sha256(user_id.encode()).hexdigest()[:24]
+        return f"{self.prefix}/{digest}/{profile}.json"
+
+    def load(self, user_id, profile):
+        key = self._key(user_id, profile)
+        if not self.client.exists(key):
+            return None
+        return json.loads(self.client.download_as_text(key))
+
+    def save(self, user_id, profile, settings):
+        self.client.upload_from_text(self._key(user_id, profile), json.dumps(settings))
+
+    def delete(self, user_id, profile):
+        self.client.delete(self._key(user_id, profile), ignore_not_found=True)
+
+    def list_profiles(self, user_id):
+        prefix = self._key(user_id, '')[:-len('.json')]
+        return sorted(obj.name[len(prefix):-5] for obj in self.client.list(prefix=prefix))
+
+def default_backend():
+    """Replit Object Storage when available, otherwise local files"""
+    try:
+        return ReplitObjectStorageBackend()
+    except Exception:
+        return LocalFileBackend()
+
+class SettingsStore:
+    """In-memory settings cache with write-behind persistence on a background thread"""
+
+    def __init__(self, backend=None, defaults=None):
+        self.backend = backend or LocalFileBackend()
+        self.defaults = dict(defaults or DEFAULT_SETTINGS)
+        self._cache = {}
+        self._profiles = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='settings-writer', daemon=True)
+        self._writer.start()
+
+    def get(self, user_id, profile=DEFAULT_PROFILE):
+        """Settings for a user's profile; only the first read per profile touches the backend"""
+        key = (user_id, profile)
+        with self._lock:
+            if key in self._cache:
+                return dict(self._cache[key])
+
+        settings = dict(self.defaults)
+        try:
+            stored = self.backend.load(user_id, profile)
+            if stored:
+                settings.update(stored)
+        except Exception as e:
+            print(f"Error loading settings: {e}")
+
+        with self._lock:
+            # A save that raced with the load wins
+            settings = self._cache.setdefault(key, settings)
+            return dict(settings)
+
+    def save(self, user_id, profile, settings):
+        """Update the cache immediately and persist in the background"""
+        key = (user_id, profile)
+        profiles = self._known_profiles(user_id)
+        with self._lock:
+            self._cache[key] = dict(settings)
+            profiles.add(profile)
+            queued = key in self._pending
+            self._pending[key] = dict(settings)
+        # Repeated saves of the same profile collapse into one write
+        if not queued:
+            self._queue.put(key)
+
+    def delete(self, user_id, profile):
+        """Forget a profile"""
+        key = (user_id, profile)
+        profiles = self._known_profiles(user_id)
+        with self._lock:
+            self._cache.pop(key, None)
+            profiles.discard(profile)
+            queued = key in self._pending
+            self._pending[key] = None
+        if not queued:
+            self._queue.put(key)
+
+    def list_profiles(self, user_id):
+        """Names of a user's saved profiles"""
+        known = self._known_profiles(user_id)
+        with self._lock:
+            return sorted(known | {DEFAULT_PROFILE})
+
+    def _known_profiles(self, user_id):
+        """The user's profile names, loaded from the backend on first use"""
+        with self._lock:
+            known = self._profiles.get(user_id)
+        if known is None:
+            try:
+                stored = set(self.backend.list_profiles(user_id))
+            except Exception as e:
+                print(f"Error listing settings profiles: {e}")
+                stored = set()
+            with self._lock:
+                known = self._profiles.setdefault(user_id, stored)
+        return known
+
+    def flush(self):
+        """Block until every queued write has been persisted"""
+        self._queue.join()
+
+    def _write_loop(self):
+        while True:
+            key = self._queue.get()
+            try:
+                with self._lock:
+                    settings = self._pending.pop(key)
+                user_id, profile = key
+                if settings is None:
+                    self.backend.delete(user_id, profile)
+                else:
+                    self.backend.save(user_id, profile, settings)
+            except Exception as e:
+                print(f"Error saving settings: {e}")
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,143 @@
+"""Shared memory transport for page images between the API and its worker processes.
+
+The owner process keeps a BufferPool of equally sized shared memory blocks.
+Only small ImageHandle objects are pickled across the process boundary;
+workers attach to the block and read or write pixels in place.
+"""
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+class ImageHandle:
+    """Picklable reference to an image stored in a shared memory block"""
+
+    def __init__(self, name, capacity, shape=None, dtype='uint8'):
+        self.name = name
+        self.capacity = capacity
+        self.shape = shape
+        self.dtype = dtype
+
+    def with_image(self, shape, dtype):
+        return ImageHandle(self.name, self.capacity, tuple(shape), np.dtype(dtype).str)
+
+    def __repr__(self):
+        return f"ImageHandle({self.name!r}, shape={self.shape})"
+
+class BufferPool:
+    """Ref-counted shared memory blocks of one size, reused across requests
+
+    Blocks are created on demand up to max_blocks (further limited by the free
+    space in /dev/shm) and kept for reuse until close(). acquire() returns None
+    when the pool is exhausted so callers can fall back to pickling.
+    """
+
+    def __init__(self, block_size, max_blocks=16):
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        try:
+            # Touching more than /dev/shm really holds kills the process with SIGBUS
+            self.max_blocks = min(max_blocks, int(shutil.disk_usage('/dev/shm').free * 0.8) // block_size)
+        except OSError:
+            pass
+        if sys.version_info < (3, 13):
+            # Workers forked from here on share this tracker instead of starting
+            # their own, which would unlink the blocks when the worker exits
+            resource_tracker.ensure_running()
+        self._blocks = {}
+        self._references = {}
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """A block with one reference, or None if the pool is full"""
+        with self._lock:
+            if self._free:
+                block = self._free.pop()
+            elif len(self._blocks) < self.max_blocks:
+                block = shared_memory.SharedMemory(create=True, size=self.block_size)
+                self._blocks[block.name] = block
+            else:
+                return None
+            self._references[block.name] = 1
+            return ImageHandle(block.name, self.block_size)
+
+    def retain(self, handle):
+        with self._lock:
+            self._references[handle.name] += 1
+
+    def release(self, handle):
+        """Drop a reference; the block returns to the pool when none are left"""
+        if handle is None:
+            return
+        with self._lock:
+            self._references[handle.name] -= 1
+            if self._references[handle.name] == 0:
+                del self._references[handle.name]
+                self._free.append(self._blocks[handle.name])
+
+    def stats(self):
+        with self._lock:
+            return {'block_size': self.block_size, 'max_blocks': self.max_blocks,
+                    'allocated': len(self._blocks), 'in_use': len(self._references)}
+
+    def close(self):
+        with self._lock:
+            for block in self._blocks.values():
+                block.close()
+                try:
+                    block.unlink()
+                except FileNotFoundError:
+                    pass
+            self._blocks.clear()
+            self._references.clear()
+            self._free.clear()
+
+# Blocks this process has attached to, most recently used last
+_attached = OrderedDict()
+_attached_lock = threading.Lock()
+MAX_ATTACHED = 64
+
+def _attach(name):
+    with _attached_lock:
+        block = _attached.pop(name, None)
+        if block is None:
+            if sys.version_info >= (3, 13):
+                block = shared_memory.SharedMemory(name=name, track=False)
+            else:
+                # Registers with the owner's tracker (see BufferPool), which the
+                # owner's unlink unregisters again
+                block = shared_memory.SharedMemory(name=name)
+            while len(_attached) >= MAX_ATTACHED:
+                _, stale = _attached.popitem(last=False)
+                try:
+                    stale.close()
+                except BufferError:
+                    # Still viewed by an array somewhere; the mapping goes away with it
+                    pass
+        _attached[name] = block
+        return block
+
+def write_image(handle, image_array):
+    """Copy pixels into the handle's block; returns the filled handle, or None if they do not fit"""
+    image_array = np.ascontiguousarray(image_array)
+    if handle is None or image_array.nbytes > handle.capacity:
+        return None
+    block = _attach(handle.name)
+    view = np.ndarray(image_array.shape, image_array.dtype, buffer=block.buf)
+    view[...] = image_array
+    del view
+    return handle.with_image(image_array.shape, image_array.dtype)
+
+def read_image(handle, copy=False):
+    """Array over the pixels a handle refers to (a view into shared memory unless copy)"""
+    block = _attach(handle.name)
+    view = np.ndarray(handle.shape, np.dtype(handle.dtype), buffer=block.buf)
+    return view.copy() if copy else view
+
+def block_size_for(max_dimension, channels=3):
+    """Bytes needed for the largest page preprocess_image produces at max_dimension"""
+    return max_dimension * max_dimension * channels
@@ -0,0 +1,46 @@
+"""Measure cold-start import costs of the app.
+
+Run with: python startup_benchmark.py [--runs N]
+Each measurement uses a fresh interpreter so nothing is cached between runs.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+from resources import HEAVY_MODULES
+
+def time_in_fresh_interpreter(statement):
+    """Seconds spent executing statement in a new Python process"""
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(time.perf_counter() - start)\n"
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return float(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help="repetitions per measurement")
+    args = parser.parse_args()
+
+    measurements = [
+        ('app module (first paint path)', 'import main'),
+        ('app script, bare mode', "import runpy; runpy.run_path('main.py', run_name='__main__')"),
+    ] + [(f'import {name}', f'import {name}') for name in HEAVY_MODULES]
+
+    print(f"{'measurement':<36} {'median':>9} {'min':>9}")
+    for label, statement in measurements:
+        try:
+            timings = [time_in_fresh_interpreter(statement) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{label:<36} skipped ({e})")
+            continue
+        print(f"{label:<36} {statistics.median(timings) * 1000:>7.0f}ms {min(timings) * 1000:>7.0f}ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import threading
+import time
+
+from pipeline import Pipeline, Stage
+
+
+def test_feeder_blocks_behind_a_slow_item():
+    pulled = []
+    release_first = threading.Event()
+
+    def items():
+        for index in range(40):
+            pulled.append(index)
+            yield index
+
+    def work(value):
+        if value == 0:
+            release_first.wait(5)
+        return value
+
+    pipeline = Pipeline([Stage('work', work, workers=4)], queue_size=2)
+    results = pipeline.run(items())
+    consumer = threading.Thread(target=lambda: collected.extend(results))
+    collected = []
+    consumer.start()
+
+    # Give the feeder time to run ahead as far as it is allowed to
+    time.sleep(0.5)
+    assert len(pulled) == pipeline.max_in_flight
+    assert not collected
+
+    release_first.set()
+    consumer.join(5)
+    assert [value for _, value, _ in collected] == list(range(40))
+
+
+def test_results_keep_input_order_and_errors():
+    def work(value):
+        if value == 3:
+            raise ValueError("bad item")
+        return value * 2
+
+    results = list(Pipeline([Stage('work', work, workers=3)]).run(range(6)))
+    assert [item for item, _, _ in results] == list(range(6))
+    assert isinstance(results[3][2], ValueError)
+    assert [value for _, value, error in results if error is None] == [0, 2, 4, 8, 10]
@@ -1,21 +1,115 @@
-import streamlit as st
 from PIL import Image
 import io
 
-def load_image(uploaded_file):
-    """Load and validate uploaded image"""
+# Uploads handled as video streams by capture.py
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv', '.webm')
+
+# Uploads above this are rejected before any pixels are decoded
+MAX_IMAGE_PIXELS = 100_000_000
+
+def load_image(uploaded_file, max_dimension=None):
+    """Load and validate uploaded image, decoding JPEGs at reduced scale when max_dimension allows"""
     try:
         image = Image.open(uploaded_file)
-        return image
     except Exception as e:
         raise Exception("Error loading image. Please ensure it's a valid image file.")
 
-def show_error(error_message):
-    """Display error message in both English and Hindi"""
-    st.error(f"""
-    🚫 Error (त्रुटि):
-    
-    English: {error_message}
-    
-    Hindi: कृपया सही फ़ाइल अपलोड करें और पुनः प्रयास करें।
-    """)
+    # Only the header has been read so far
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise Exception(
+            f"Image is too large ({width}x{height}). Maximum is {MAX_IMAGE_PIXELS // 1_000_000} megapixels."
+        )
+
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while both sides stay above max_dimension,
+    # leaving headroom for cropping to a document inside the frame
+    if max_dimension and image.format == 'JPEG' and min(width, height) >= 2 * max_dimension:
+        image.draft('RGB', (max_dimension, max_dimension))
+    return image
+
+def iter_pdf_pages(uploaded_file, dpi=200):
+    """Yield the pages of a PDF as PIL images, one at a time"""
+    data = uploaded_file.getvalue() if hasattr(uploaded_file, 'getvalue') else uploaded_file.read()
+    with _open_pdf(data) as document:
+        for page in document:
+            yield _page_image(document, page, dpi)
+
+def _open_pdf(data):
+    try:
+        import pymupdf
+    except ImportError:
+        raise Exception("PDF support requires PyMuPDF. Install it with 'pip install pymupdf'.")
+
+    try:
+        return pymupdf.open(stream=data, filetype="pdf")
+    except Exception:
+        raise Exception("Error loading PDF. Please ensure it's a valid PDF file.")
+
+def pdf_page_count(data):
+    """Number of pages in a PDF given as bytes"""
+    with _open_pdf(data) as document:
+        return document.page_count
+
+def load_pdf_page(data, page_index, dpi=200):
+    """Decode a single page of a PDF given as bytes"""
+    with _open_pdf(data) as document:
+        return _page_image(document, document[page_index], dpi)
+
+def _page_image(document, page, dpi):
+    """Embedded scan of the page if there is one, otherwise a render at dpi"""
+    import pymupdf
+
+    image = _extract_page_image(document, page)
+    if image is None:
+        # Render pages that are not a single full-page scan, at a lower resolution
+        # if the page is too large to fit in MAX_IMAGE_PIXELS at dpi
+        points = page.rect.width * page.rect.height
+        if points > 0:
+            dpi = min(dpi, int(72 * (MAX_IMAGE_PIXELS / points) ** 0.5))
+        pixmap = page.get_pixmap(dpi=max(dpi, 1), colorspace=pymupdf.csRGB, alpha=False)
+        image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    return image
+
+def _extract_page_image(document, page):
+    """Return the embedded image of a single-image scanned page without re-rasterizing"""
+    images = page.get_images(full=True)
+    if len(images) != 1:
+        return None
+
+    xref, smask = images[0][0], images[0][1]
+    if smask or images[0][2] * images[0][3] > MAX_IMAGE_PIXELS:
+        return None
+
+    # The image must cover (nearly) the whole page
+    rects = page.get_image_rects(xref)
+    if len(rects) != 1 or rects[0].get_area() < 0.9 * page.rect.get_area():
+        return None
+
+    # Visible text or vector drawings on top of the scan need a real render
+    if page.get_drawings() or any(span['type'] != 3 for span in page.get_texttrace()):
+        return None
+
+    # Only an upright placement matches the stored pixels; rotated or flipped
+    # drawing transforms are left to the renderer
+    info = page.get_image_info(xrefs=True)
+    if len(info) != 1:
+        return None
+    a, b, c, d = info[0]['transform'][:4]
+    if a <= 0 or d <= 0 or abs(b) > 1e-6 * a or abs(c) > 1e-6 * d:
+        return None
+
+    extracted = document.extract_image(xref)
+    if not extracted or not extracted.get('image'):
+        return None
+
+    # Pillow cannot decode every PDF image codec (JBIG2, some JPX)
+    try:
+        image = Image.open(io.BytesIO(extracted['image']))
+        image.load()
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+    except Exception:
+        return None
+    if page.rotation:
+        image = image.rotate(-page.rotation, expand=True)
+    return image